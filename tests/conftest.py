@@ -0,0 +1,8 @@
+import os
+import sys
+
+#the engine and the mesh helpers are imported as top level modules
+sys.path[:0] = [os.path.dirname(os.path.dirname(os.path.abspath(__file__))), os.path.dirname(os.path.abspath(__file__))]
+
+def pytest_addoption(parser):
+    parser.addoption("--large", action="store_true", help="also benchmark meshes of 1M quads")
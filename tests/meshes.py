@@ -0,0 +1,124 @@
+"""Synthetic quad meshes as the flat loop arrays the addon reads from bmesh
+
+Grids, cylinders and tori of nx by ny quads, laid out like UvLoopBuffer holds
+them: four loops per face in order, with the mesh vert, edge and face of every
+loop and uvs unwrapped on a regular grid. Cylinders and tori are cut along the
+edges where they wrap around, those edges are seams.
+"""
+
+import numpy as np
+from uv_squares_engine import UvVerts
+
+#corner offsets of the loops of a face, counterclockwise
+CORNERS = np.array(((0, 0), (1, 0), (1, 1), (0, 1)))
+
+class QuadMesh:
+
+    def __init__(self, nx, ny, wrapX = False, wrapY = False, jitter = 0.0, seed = 1):
+        self.nx, self.ny = nx, ny
+        faceCount = nx * ny
+        vx = nx if wrapX else nx + 1
+        vy = ny if wrapY else ny + 1
+
+        i, j = np.meshgrid(np.arange(nx), np.arange(ny))
+        ci = i.reshape(-1, 1) + CORNERS[:, 0]
+        cj = j.reshape(-1, 1) + CORNERS[:, 1]
+
+        self.faceStart = np.arange(faceCount + 1, dtype=np.int32) * 4
+        self.face = np.repeat(np.arange(faceCount, dtype=np.int32), 4)
+        self.vert = ((cj % vy) * vx + (ci % vx)).ravel().astype(np.int32)
+        self.vertCount = vx * vy
+
+        #an edge is the pair of verts of a loop and the next one of its face
+        following = self.following(np.arange(len(self.vert)))
+        pairs = np.sort(np.stack([self.vert, self.vert[following]], axis=1), axis=1)
+        edges, self.edge = np.unique(pairs, axis=0, return_inverse=True)
+        self.edge = self.edge.ravel().astype(np.int32)
+        self.edgeCount = len(edges)
+
+        self.uv = np.stack([ci.ravel() / nx, cj.ravel() / ny], axis=1).astype(np.float32)
+        if jitter > 0:
+            #move uv verts, not single loops, so the uvs stay connected
+            offset = np.random.default_rng(seed).uniform(-jitter, jitter, (self.vertCount, 2))
+            self.uv += offset[self.vert].astype(np.float32)
+
+        #loops whose edge wraps around from the last row or column to the first
+        wrapped = (wrapX & (ci.ravel() == nx) & (ci.ravel()[following] == nx) |
+                   wrapY & (cj.ravel() == ny) & (cj.ravel()[following] == ny))
+        self.seam = np.isin(self.edge, self.edge[wrapped])
+
+    def following(self, loops):
+        """Next loop of the face of every loop"""
+        return loops - loops % 4 + (loops + 1) % 4
+
+    def uvVertPairs(self):
+        """Pairs of loops on the same mesh vert and uv spot"""
+        keys = np.stack([self.vert, *np.round(self.uv * 4096).astype(np.int64).T], axis=1)
+        order = np.lexsort(keys.T[::-1])
+        same = (keys[order][1:] == keys[order][:-1]).all(axis=1)
+        return np.stack([order[:-1][same], order[1:][same]], axis=1)
+
+    def uvVerts(self, pairs = None):
+        """Grouped UvVerts of all loops"""
+        uvVerts = UvVerts(len(self.vert), list(range(len(self.vert))))
+        if pairs is None: pairs = self.uvVertPairs()
+        for a, b in pairs.tolist():
+            uvVerts.join(a, b)
+        uvVerts.group()
+        return uvVerts
+
+    def steps(self, facs = None):
+        """FollowActiveSteps of the whole mesh from face 0, on the loop arrays
+
+        facs gives the factor of every step, 1.0 for all (EVEN) when None.
+        """
+        #the other loop of every edge that is not a seam or a boundary
+        order = np.argsort(self.edge, kind='stable')
+        edge = self.edge[order]
+        same = edge[1:] == edge[:-1]
+        radial = np.full(len(self.vert), -1)
+        radial[order[:-1][same]] = order[1:][same]
+        radial[order[1:][same]] = order[:-1][same]
+        radial[self.seam] = -1
+        radial = radial.tolist()
+        vert = self.vert.tolist()
+
+        faceCount = len(self.faceStart) - 1
+        depth = [-1] * faceCount
+        depth[0] = 0
+        steps = []
+        depths = []
+        faces = [0]
+        while faces:
+            after = []
+            for f in faces:
+                for l in range(4 * f, 4 * f + 4):
+                    r = radial[l]
+                    if r == -1 or depth[r // 4] != -1: continue
+                    g = r // 4
+                    depth[g] = depth[f] + 1
+                    after.append(g)
+
+                    l_a = [4 * f + (l + k) % 4 for k in range(4)]
+                    if vert[r] != vert[l]:
+                        #l_b[1] is r, the others follow it around face g
+                        l_b = [4 * g + (r + k) % 4 for k in (1, 0, 3, 2)]
+                    else: l_b = [4 * g + (r + k) % 4 for k in range(4)]
+                    steps.append(l_a + l_b)
+                    depths.append(depth[g])
+            faces = after
+
+        rows = [0] + (np.flatnonzero(np.diff(depths)) + 1).tolist() + [len(depths)]
+        if facs is None: facs = np.ones(len(depths), dtype=np.float32)
+        return np.array(steps, dtype=np.int32).reshape(-1, 8), facs.astype(np.float32), rows
+
+def Grid(nx, ny, **kwargs):
+    return QuadMesh(nx, ny, **kwargs)
+
+def Cylinder(nx, ny, **kwargs):
+    return QuadMesh(nx, ny, wrapX=True, **kwargs)
+
+def Torus(nx, ny, **kwargs):
+    return QuadMesh(nx, ny, wrapX=True, wrapY=True, **kwargs)
+
+SHAPES = {"grid": Grid, "cylinder": Cylinder, "torus": Torus}
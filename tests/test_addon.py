@@ -0,0 +1,86 @@
+"""Checks of the addon on bmesh, they only run where bpy can be imported
+
+blender -b --python-expr "import sys, pytest; sys.exit(pytest.main(['tests']))"
+"""
+
+import numpy as np
+import pytest
+from types import SimpleNamespace
+from timeit import default_timer as timer
+
+bpy = pytest.importorskip("bpy")
+import bmesh
+import uv_squares
+
+#solved in this process, the workers would import the addon again
+SETTINGS = SimpleNamespace(use_parallel=False, threads=1)
+
+def QuadsAndTriangles(n = 6, jitter = 0.01):
+    """Grid of n by n quads whose 2 by 2 quads in the middle are cut into triangles around the center vert
+
+    Every face is selected with all its uvs, the uvs are the vert coordinates
+    moved a bit. Returns bm and the verts by row and column.
+    """
+    bm = bmesh.new()
+    uv_layer = bm.loops.layers.uv.verify()
+    verts = [[bm.verts.new((i, j, 0)) for i in range(n + 1)] for j in range(n + 1)]
+    offsets = np.random.default_rng(2).uniform(-jitter, jitter, (n + 1, n + 1, 2)).tolist()
+
+    for j in range(n):
+        for i in range(n):
+            quad = [verts[j][i], verts[j][i + 1], verts[j + 1][i + 1], verts[j + 1][i]]
+            if 2 <= i <= 3 and 2 <= j <= 3:
+                #the diagonals meet at the center vert
+                if i == j: faces = [quad[:3], [quad[0], quad[2], quad[3]]]
+                else: faces = [[quad[0], quad[1], quad[3]], quad[1:]]
+            else: faces = [quad]
+            for face in faces:
+                f = bm.faces.new(face)
+                f.select = True
+                for l in f.loops:
+                    x, y = int(l.vert.co.x), int(l.vert.co.y)
+                    l[uv_layer].uv = (x / n + offsets[y][x][0], y / n + offsets[y][x][1])
+                    l[uv_layer].select = True
+    bm.verts.index_update()
+    bm.edges.index_update()
+    bm.faces.index_update()
+    return bm, verts
+
+def LoopsAt(v):
+    return [l for f in v.link_faces for l in f.loops if l.vert == v]
+
+def UvsAt(bm, v):
+    uv_layer = bm.loops.layers.uv.verify()
+    return [tuple(l[uv_layer].uv) for l in LoopsAt(v)]
+
+@pytest.mark.parametrize("relax", (0, 20))
+@pytest.mark.parametrize("square", (True, False))
+def test_quads_and_triangles(square, relax):
+    bm, verts = QuadsAndTriangles()
+    me = bpy.data.meshes.new("QuadsAndTriangles")
+    uv_squares.islandCache.clear()
+    job = uv_squares.SquareBmesh(me, bm, uv_squares.UvContext(bpy.context), square, False, timer(), relax = relax)
+    uv_squares.SolveJobs([job], SETTINGS)
+    job.buffer.write()
+
+    #only the quads are walked, as one island around the triangles
+    assert len(job.islands) == 1
+    uv_layer = bm.loops.layers.uv.verify()
+    for f in bm.faces:
+        if len(f.loops) != 4: continue
+        uvs = np.array([l[uv_layer].uv for l in f.loops])
+        assert len(np.unique(uvs[:, 0].round(5))) == 2 and len(np.unique(uvs[:, 1].round(5))) == 2
+
+    #triangle corners on the quads follow them, the center vert is left or relaxed
+    center = verts[3][3]
+    ring = [UvsAt(bm, verts[3 + dj][3 + di]) for dj in (-1, 0, 1) for di in (-1, 0, 1) if di or dj]
+    for uvs in ring:
+        assert np.allclose(uvs, uvs[0], atol=1e-5)
+    ring = [uvs[0] for uvs in ring]
+    loops = LoopsAt(center)
+    if relax == 0:
+        original = job.original[0][[job.buffer.loopIndex[l] for l in loops]]
+        assert np.allclose(UvsAt(bm, center), original)
+        assert not any(l[uv_layer].select for l in loops)
+    else:
+        assert np.allclose(UvsAt(bm, center), np.mean(ring, axis=0), atol=1e-4)
@@ -0,0 +1,108 @@
+"""Time and peak memory of the engine on synthetic meshes of 1k to 100k quads
+
+1M quads are left out unless pytest runs with --large. Timings come from
+pytest-benchmark, the tracemalloc peak of one more run of each goes to its
+extra_info as peak_mb (pytest --benchmark-json to keep it).
+"""
+
+import tracemalloc
+import numpy as np
+import pytest
+
+pytest.importorskip("pytest_benchmark")
+
+from uv_squares_engine import (IslandLabels, IslandMembers, UvVerts, JoinCoincident, PropagateRows,
+    MakeUvFaceEqualRectangle, CornerGroups, Corners, RelaxUvVerts, SnapToTexels)
+from meshes import SHAPES
+
+#quads per side of each size
+SIZES = {"1k": 32, "10k": 100, "100k": 316, "1M": 1000}
+
+#module scope runs all benchmarks of a mesh after another, it is built once for them
+@pytest.fixture(scope="module", params=[(shape, size) for size in SIZES for shape in SHAPES], ids="-".join)
+def mesh(request):
+    shape, size = request.param
+    if size == "1M" and not request.config.getoption("--large"):
+        pytest.skip("needs --large")
+    n = SIZES[size]
+    return SHAPES[shape](n, n, jitter=0.1 / n)
+
+def Measure(benchmark, fn, setup):
+    """Benchmarks fn on fresh arguments from setup, then records its tracemalloc peak"""
+    rounds = max(3, min(20, 400000 // len(benchmark.mesh.vert)))
+    benchmark.pedantic(fn, setup=lambda: (setup(), {}), rounds=rounds)
+    #tracing slows down the python loops several times, only trace when measuring
+    if benchmark.disabled: return
+
+    args = setup()
+    tracemalloc.start()
+    fn(*args)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    benchmark.extra_info["peak_mb"] = round(peak / 2 ** 20, 3)
+
+@pytest.fixture
+def measure(benchmark, mesh):
+    benchmark.mesh = mesh
+    return lambda fn, setup: Measure(benchmark, fn, setup)
+
+def Cached(mesh, name, make):
+    """Pieces of mesh that take long to build but are not measured themselves"""
+    if not hasattr(mesh, name): setattr(mesh, name, make())
+    return getattr(mesh, name)
+
+def test_island_labels(mesh, measure):
+    linked = ~mesh.seam
+    faceMask = np.ones(len(mesh.faceStart) - 1, dtype=bool)
+    measure(IslandLabels, lambda: (faceMask, mesh.face[linked], mesh.edge[linked]))
+
+def test_island_members(mesh, measure):
+    #a row of faces per island
+    labels = (np.arange(len(mesh.faceStart) - 1) // mesh.nx).astype(np.int32)
+    measure(IslandMembers, lambda: (labels,))
+
+def test_uv_verts(mesh, measure):
+    pairs = Cached(mesh, "pairs", mesh.uvVertPairs).tolist()
+    loops = list(range(len(mesh.vert)))
+
+    def Group(pairs):
+        uvVerts = UvVerts(len(loops), loops)
+        for a, b in pairs:
+            uvVerts.join(a, b)
+        uvVerts.group()
+
+    measure(Group, lambda: (pairs,))
+
+def test_join_coincident(mesh, measure):
+    loops = list(range(len(mesh.vert)))
+    measure(JoinCoincident, lambda: (mesh.uv, loops, UvVerts(len(loops), loops)))
+
+def test_propagate_rows(mesh, measure):
+    steps = Cached(mesh, "followed", mesh.steps)
+    measure(PropagateRows, lambda: (mesh.uv.copy(), *steps))
+
+def test_make_uv_face_equal_rectangle(mesh, measure):
+    #every face as an island of its own, as when no two selected quads touch
+    faces = np.arange(0, len(mesh.vert), 4).tolist()
+    shapes = [Corners(mesh.uv, [f, f + 1, f + 2, f + 3]) for f in faces]
+    groups = CornerGroups({l: np.array([l]) for l in range(len(mesh.vert))})
+
+    def Shape(uv):
+        for lucv, ldcv, rucv, rdcv in shapes:
+            MakeUvFaceEqualRectangle(uv, groups, lucv, rucv, rdcv, ldcv, lucv, True, 1.0)
+
+    measure(Shape, lambda: (mesh.uv.copy(),))
+
+def test_relax_uv_verts(mesh, measure):
+    uvVerts = Cached(mesh, "grouped", mesh.uvVerts)
+    loops = np.arange(len(mesh.vert), dtype=np.int32)
+    ids = uvVerts.ids[loops]
+    edges = np.unique(np.sort(np.stack([ids, ids[mesh.following(loops)]], axis=1), axis=1), axis=0)
+    fixed = np.zeros(ids.max() + 1, dtype=bool)
+    fixed[ids[::8]] = True
+    measure(RelaxUvVerts, lambda: (mesh.uv.copy(), loops, ids, fixed, edges, 10))
+
+def test_snap_to_texels(mesh, measure):
+    loops = np.arange(len(mesh.vert))
+    texel = np.array((1 / 1024, 1 / 1024), dtype=np.float32)
+    measure(SnapToTexels, lambda: (mesh.uv.copy(), loops, texel))
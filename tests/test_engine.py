@@ -0,0 +1,158 @@
+import numpy as np
+import pytest
+
+from uv_squares_engine import (IslandLabels, IslandMembers, UvVerts, JoinCoincident, PropagateRows,
+    MakeUvFaceEqualRectangle, Corners, RelaxUvVerts, SnapToTexels, SquareIslands, IslandsOnOwnLoops)
+from meshes import Grid, Cylinder, Torus, SHAPES
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_island_labels_of_connected_mesh(shape):
+    mesh = SHAPES[shape](6, 4)
+    linked = ~mesh.seam
+    labels = IslandLabels(np.ones(24, dtype=bool), mesh.face[linked], mesh.edge[linked])
+    assert (labels == 0).all()
+
+def test_island_labels_split_by_seams_and_mask():
+    mesh = Grid(6, 4)
+    #cut the grid between columns 2 and 3
+    column = np.arange(24) % 6
+    loops = np.arange(len(mesh.vert))
+    cut = np.isin(mesh.edge, mesh.edge[(column[mesh.face] == 2) & (loops % 4 == 1)])
+    mask = np.ones(24, dtype=bool)
+    mask[5] = False
+
+    labels = IslandLabels(mask, mesh.face[~cut], mesh.edge[~cut])
+    assert labels[5] == -1
+    assert len(set(labels[column <= 2].tolist())) == 1
+    assert len(set(labels[(column > 2) & mask].tolist())) == 1
+    assert labels[0] != labels[3]
+
+    members = IslandMembers(labels)
+    assert [m.tolist() for m in members] == [np.flatnonzero(labels == k).tolist() for k in range(2)]
+
+def test_uv_verts_group_loops_of_a_vert():
+    mesh = Grid(3, 3)
+    uvVerts = mesh.uvVerts()
+    #the inner verts are used by four faces, the corners of the grid by one
+    sizes = sorted(len(group) for group in uvVerts.groups())
+    assert sizes == [1] * 4 + [2] * 8 + [4] * 4
+    for group in uvVerts.groups():
+        assert len(set(mesh.vert[group].tolist())) == 1
+
+def test_uv_verts_keep_seams_apart():
+    mesh = Cylinder(4, 2)
+    uvVerts = mesh.uvVerts()
+    #verts on the seam have a uv vertex on both sides of it
+    assert len(list(uvVerts.groups())) == mesh.vertCount + 3
+
+def test_join_coincident():
+    uv = np.array(((0, 0), (1, 0), (0, 0.000001), (1, 1), (1.000001, 0)), dtype=np.float32)
+    uvVerts = UvVerts(5, [0, 1, 2, 3, 4])
+    found = JoinCoincident(uv, [0, 1, 2, 3, 4], uvVerts)
+    assert found == [0, 1, 3]
+    assert sorted(uvVerts.members(0).tolist()) == [0, 2]
+    assert sorted(uvVerts.members(4).tolist()) == [1, 4]
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_propagate_rows_extends_regular_grid(shape):
+    mesh = SHAPES[shape](8, 6)
+    steps = mesh.steps()
+    uv = mesh.uv.copy()
+    #only the first face is known, everything else is propagated from it
+    uv[4:] = 0
+    PropagateRows(uv, *steps)
+    assert np.allclose(uv, mesh.uv, atol=1e-6)
+
+def test_propagate_rows_follows_facs():
+    mesh = Grid(5, 1)
+    facs = np.full(4, 2, dtype=np.float32)
+    uv = mesh.uv.copy()
+    PropagateRows(uv, *mesh.steps(facs))
+    #every face is twice as wide as the previous one
+    right = uv[mesh.following(np.arange(0, 20, 4)), 0]
+    widths = np.diff(np.concatenate([[0], right]))
+    assert np.allclose(widths[1:] / widths[:-1], 2)
+
+def ExtrapolateFaces(uv, steps, facs):
+    """Per face extrapolation of FollowActiveUV, in float32 like mathutils vectors"""
+    for step, fac in zip(steps.tolist(), facs):
+        l_a, l_b = step[:4], step[4:]
+        for inner, outer in ((0, 3), (1, 2)):
+            l_a_inner = uv[l_a[inner]].copy()
+            uv[l_b[inner]] = l_a_inner
+            uv[l_b[outer]] = l_a_inner + ((l_a_inner - uv[l_a[outer]]) * np.float32(fac))
+
+@pytest.mark.parametrize("shape", SHAPES)
+def test_propagate_rows_bit_identical_to_faces(shape):
+    mesh = SHAPES[shape](12, 9, jitter=0.02)
+    steps = mesh.steps()
+    facs = np.random.default_rng(5).uniform(0.5, 2, len(steps[0])).astype(np.float32)
+    expected = mesh.uv.copy()
+    ExtrapolateFaces(expected, steps[0], facs)
+
+    uv = mesh.uv.copy()
+    PropagateRows(uv, steps[0], facs, steps[2])
+    assert uv.dtype == np.float32
+    assert np.array_equal(uv.view(np.int32), expected.view(np.int32))
+
+@pytest.mark.parametrize("square", (False, True))
+def test_make_uv_face_equal_rectangle(square):
+    mesh = Grid(1, 1, jitter=0.05)
+    uvVerts = mesh.uvVerts()
+    uv = mesh.uv.copy()
+    lucv, ldcv, rucv, rdcv = Corners(uv, [0, 1, 2, 3])
+    MakeUvFaceEqualRectangle(uv, uvVerts, lucv, rucv, rdcv, ldcv, lucv, square, 2.0)
+
+    assert uv[lucv, 1] == uv[rucv, 1] and uv[ldcv, 1] == uv[rdcv, 1]
+    assert uv[lucv, 0] == uv[ldcv, 0] and uv[rucv, 0] == uv[rdcv, 0]
+    width = uv[rucv, 0] - uv[lucv, 0]
+    height = uv[lucv, 1] - uv[ldcv, 1]
+    #the start corner stays in place
+    assert np.array_equal(uv[lucv], mesh.uv[lucv])
+    if square: assert height == pytest.approx(width * 2, rel=1e-6)
+    else: assert height == pytest.approx(np.hypot(*(mesh.uv[lucv] - mesh.uv[ldcv])), rel=1e-6)
+
+def test_make_uv_face_equal_rectangle_on_texels():
+    mesh = Grid(1, 1, jitter=0.05)
+    uv = mesh.uv.copy()
+    lucv, ldcv, rucv, rdcv = Corners(uv, [0, 1, 2, 3])
+    texel = np.array((1 / 64, 1 / 32), dtype=np.float32)
+    MakeUvFaceEqualRectangle(uv, mesh.uvVerts(), lucv, rucv, rdcv, ldcv, lucv, True, 1.0, texel)
+    assert np.allclose(uv / texel, np.round(uv / texel), atol=1e-4)
+
+def test_relax_uv_verts_spreads_inner_verts():
+    mesh = Grid(4, 4)
+    uvVerts = mesh.uvVerts()
+    loops = np.arange(len(mesh.vert), dtype=np.int32)
+    ids = uvVerts.ids[loops]
+    edges = np.unique(np.sort(np.stack([ids, ids[mesh.following(loops)]], axis=1), axis=1), axis=0)
+    #the border of the grid is fixed, the inner verts start all on one spot
+    x, y = mesh.uv[loops].T
+    fixed = np.zeros(ids.max() + 1, dtype=bool)
+    fixed[ids[(x == 0) | (x == 1) | (y == 0) | (y == 1)]] = True
+    uv = mesh.uv.copy()
+    uv[~fixed[ids]] = 0.5
+
+    RelaxUvVerts(uv, loops, ids, fixed, edges, 200)
+    assert np.allclose(uv, mesh.uv, atol=1e-5)
+
+def test_snap_to_texels():
+    uv = np.random.default_rng(3).random((100, 2)).astype(np.float32)
+    before = uv.copy()
+    texel = np.array((1 / 256, 1 / 128), dtype=np.float32)
+    SnapToTexels(uv, np.arange(0, 100, 2), texel)
+    assert np.allclose(uv[::2] / texel, np.round(uv[::2] / texel), atol=1e-3)
+    assert (np.abs(uv[::2] - before[::2]) <= texel / 2 + 1e-7).all()
+    assert np.array_equal(uv[1::2], before[1::2])
+
+def test_square_islands_on_own_loops():
+    mesh = Torus(8, 6, jitter=0.01)
+    uvVerts = mesh.uvVerts()
+    lucv, ldcv, rucv, rdcv = Corners(mesh.uv, [0, 1, 2, 3])
+    shape = (lucv, rucv, rdcv, ldcv, rdcv)
+    islands = [(shape, {c: uvVerts.members(c) for c in shape[:4]}, mesh.steps())]
+
+    uv, shaping, propagation = SquareIslands(mesh.uv.copy(), islands, True, 1.0)
+    loops, remapped = IslandsOnOwnLoops(islands)
+    own, shaping, propagation = SquareIslands(mesh.uv[loops], remapped, True, 1.0)
+    assert np.array_equal(own, uv[loops])
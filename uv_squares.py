@@ -26,11 +26,30 @@ bl_info = {
 
 import bpy
 import bmesh
-from collections import defaultdict
-from math import radians, hypot
+import numpy as np
+import os
+import sys
+import json
+import argparse
+import tracemalloc
+import site
+import copy
+import importlib.util
+import multiprocessing
+from array import array
+from fnmatch import fnmatchcase
+from collections import OrderedDict, defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from threading import Lock
+from math import radians
 from timeit import default_timer as timer
 
-precision = 3
+try:
+    from .uv_squares_engine import *
+except ImportError:
+    #not loaded as a package, e.g. blender -b -P uv_squares.py
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    from uv_squares_engine import *
 
 #todo: make joining radius scale with editor zoom rate or average unit length
 #todo: align to axis by respect to vert distance
@@ -47,11 +66,41 @@ def main(context, operator, square = False, snapToClosest = False):
     if (context.edit_object not in selected_objects):
         selected_objects.append(context.edit_object)
 
+    settings = context.scene.uv_squares
+    uvContext = UvContext(context, settings.texel_mip if settings.texel_snap else None)
+    jobs = []
+    meshes = set()
     for obj in selected_objects:
-        if (obj.type == "MESH"):
-            main1(obj, context, operator, square, snapToClosest)
+        #objects sharing a mesh would square it again
+        if (obj.type == "MESH") and obj.data.as_pointer() not in meshes:
+            meshes.add(obj.data.as_pointer())
+            job = main1(obj, context, uvContext, operator, square, snapToClosest)
+            if job != None: jobs += [job] + job.layerJobs
+
+    SolveJobs(jobs, context.scene.uv_squares)
+    for job in jobs:
+        job.finish()
+
+def SolveJobs(jobs, settings, parallel = True):
+    workers = settings.threads or os.cpu_count() or 1
+    if not (parallel and settings.use_parallel): workers = 1
+
+    #islands share no uv verts, each chunk of them is solved on its own
+    tasks = [(job, chunk) for job in jobs for chunk in job.chunks(workers)]
+    if workers > 1 and len(tasks) > 1:
+        pool = workerPool.start(workers)
+        for receive in [job.submitIslands(pool, chunk) for job, chunk in tasks]:
+            receive()
+    else:
+        for job, chunk in tasks:
+            job.solveIslands(chunk)
+
+    for job in jobs:
+        job.solveTexels()
+        job.solveRejoin()
+        job.solveRelax()
 
-def main1(obj, context, operator, square, snapToClosest):
+def main1(obj, context, uvContext, operator, square, snapToClosest):
     if context.scene.tool_settings.use_uv_select_sync:
         operator.report({'ERROR'}, "Please disable 'Keep UV and edit mesh in sync'")
         # context.scene.tool_settings.use_uv_select_sync = False
@@ -60,98 +109,288 @@ def main1(obj, context, operator, square, snapToClosest):
     startTime = timer()
     me = obj.data
     bm = bmesh.from_edit_mesh(me)
+    profiler.count(objects=1)
+
+    settings = context.scene.uv_squares
+    layers = UvLayersMatching(bm, settings.uv_maps)
+    if settings.low_memory:
+        chunks = IslandChunks(bm, bm.loops.layers.uv.verify(), settings.chunk_faces)
+        if len(chunks) > 1:
+            if settings.relax_non_quads:
+                operator.report({'WARNING'}, "Relax Non-Quads is not used in low memory mode")
+            return SquareChunks(me, bm, uvContext, settings, chunks, square, startTime, layers)
+    relax = settings.relax_iterations if settings.relax_non_quads else 0
+    return SquareBmesh(me, bm, uvContext, square, snapToClosest, startTime, relax = relax, layers = layers)
+
+def UvLayersMatching(bm, patterns):
+    """Uv layers of bm other than the active one with a name matching any of the comma separated patterns"""
+    patterns = [p.strip() for p in patterns.split(",") if p.strip() != ""]
+    active = bm.loops.layers.uv.verify().name
+    return [layer for name, layer in bm.loops.layers.uv.items()
+        if name != active and any(fnmatchcase(name, p) for p in patterns)]
+
+def SquareChunks(me, bm, uvContext, settings, chunks, square, startTime, layers = ()):
+    """Squares the chunks of IslandChunks one after the other, writing each back before the next is read
+
+    The islands of chunks are not cached and their edge rings are only kept for this run.
+    """
+    rings = EdgeRings(None, len(bm.edges))
+    for faces, islandCount in chunks:
+        #with more than one island the active face is not used
+        job = SquareBmesh(me, bm, uvContext, square, False, startTime,
+            [bm.faces[i] for i in faces.tolist()], useActive = False, layers = layers, rings = rings)
+        if job == None: continue
+        jobs = [job] + job.layerJobs
+        SolveJobs(jobs, settings)
+        t = timer()
+        for job in jobs:
+            uvHistory.record(me, job.buffer, job.original)
+            job.buffer.write()
+        profiler.lap("update", t)
+    return SuccessFinished(me, startTime)
+
+def SquareBmesh(me, bm, uvContext, square, snapToClosest, startTime, faces = None, useActive = True, relax = 0, layers = (), rings = None):
+    """Reads the selection and squares lines right away, for faces returns a GridJob
+
+    The islands and rows found on the active uv layer are shared with a GridJob per
+    uv layer in layers, in job.layerJobs, which square the same quads on their own uvs.
+    Islands go through islandCache unless the EdgeRings to use are given in rings.
+    """
     uv_layer = bm.loops.layers.uv.verify()
     # bm.faces.layers.tex.verify()  # currently blender needs both layers.
 
-    edgeVerts, filteredVerts, selFaces, nonQuadFaces, vertsDict, noEdge = ListsOfVerts(uv_layer, bm)
+    t = timer()
+    if faces == None:
+        buffer = SelectionBuffer(bm, uv_layer)
+    else: buffer = UvLoopBuffer(bm, uv_layer, faces)
+    uv = buffer.uv
+    original = uv.copy(), buffer.select.copy()
+
+    extendMode = 'EVEN' if square else 'LENGTH_AVERAGE'
+    cached = rings == None
+    islands = uvVerts = None
+    if cached:
+        cacheKey = islandCache.key(me, bm, buffer, extendMode)
+        islands, uvVerts = islandCache.get(cacheKey) or (None, None)
+
+    edgeVerts, filteredVerts, selFaces, nonQuadFaces, uvVerts, noEdge, quads = ListsOfVerts(buffer, uvVerts)
+    t = profiler.lap("selection", t)
+    profiler.count(faces=len(buffer.faces), loops=len(buffer.loops))
 
     if len(filteredVerts) == 0: return
     if len(filteredVerts) == 1:
-        SnapCursorToClosestSelected(filteredVerts)
+        SnapCursorToClosestSelected(uv, filteredVerts, uvContext)
         return
 
-    cursorClosestTo = CursorClosestTo(filteredVerts)
+    cursorClosestTo = ClosestTo(uv, filteredVerts, uvContext.cursors)
     #line is selected
 
     if len(selFaces) == 0:
         if snapToClosest == True:
-            SnapCursorToClosestSelected(filteredVerts)
+            SnapCursorToClosestSelected(uv, filteredVerts, uvContext)
             return
 
-        VertsDictForLine(uv_layer, bm, filteredVerts, vertsDict)
-
-        if AreVectsLinedOnAxis(filteredVerts) == False:
-            ScaleTo0OnAxisAndCursor(filteredVerts, vertsDict, cursorClosestTo)
-            return SuccessFinished(me, startTime)
-
-        MakeEqualDistanceBetweenVertsInLine(filteredVerts, vertsDict, cursorClosestTo)
+        if AreVectsLinedOnAxis(uv, filteredVerts) == False:
+            ScaleTo0OnAxisAndCursor(uv, filteredVerts, uvVerts, uvContext, cursorClosestTo)
+        else: MakeEqualDistanceBetweenVertsInLine(uv, filteredVerts, uvVerts, cursorClosestTo)
+        t = profiler.lap("shaping", t)
+        uvHistory.record(me, buffer, original)
+        buffer.write()
+        profiler.lap("update", t)
         return SuccessFinished(me, startTime)
 
-    # deselect non quads
-    for nf in nonQuadFaces:
-        for l in nf.loops:
-            luv = l[uv_layer]
-            luv.select = False
-
-    def isFaceSelected(f):
-        return f.select and all(l[uv_layer].select for l in f.loops)
-
-    def getIslandFromFace(startFace):
-        island = set()
-        toCheck = set([startFace])
-
-        while (len(toCheck)):
-            face = toCheck.pop()
-            if isFaceSelected(face) and face not in island:
-                island.add(face)
-                adjacentFaces = []
-                for e in face.edges:
-                    if e.seam == False:
-                        for f in e.link_faces:
-                            if f != face:
-                                adjacentFaces.append(f)
-                toCheck.update(adjacentFaces)
-
-        return island
-
-    def getIslandsFromSelectedFaces(selectedFaces):
+    if relax == 0:
+        # deselect non quads
+        buffer.select[np.isin(buffer.face, nonQuadFaces)] = False
+
+    if islands == None:
+        islands = []
+        #fully selected quads, connected over edges that are not seams
+        linked = ~buffer.seam
+        labels = IslandLabels(quads, buffer.face[linked], buffer.edge[linked])
+        faceSets = IslandMembers(labels)
+
+        if cached: rings = islandCache.rings(me, bm)
+        active = buffer.faceIndex.get(bm.faces.active, -1)
+        for island in faceSets:
+            targetFace = island[0]
+            if useActive and len(faceSets) == 1 and active != -1 and labels[active] != -1:
+                targetFace = active
+
+            steps = FollowActiveSteps(bm, buffer.loopIndex, buffer.faces[targetFace],
+                [buffer.faces[f] for f in island.tolist()], extendMode, rings)
+            islands.append((int(targetFace), steps))
+        if cached: islandCache.put(cacheKey, (islands, uvVerts))
+    t = profiler.lap("islands", t)
+    profiler.count(islands=len(islands))
+
+    rejoin = []
+    if noEdge == False:
+        #edge has ripped so we connect it back to the quad loop it sits on
+        rejoin = RejoinPairs(uv, buffer.vert, edgeVerts, uvVerts.loops, 10 ** -precision)
+    relaxing = None
+    if relax > 0 and len(nonQuadFaces) > 0:
+        relaxing = RelaxConstraints(buffer, nonQuadFaces, rejoin) + (relax,)
+    t = profiler.lap("rejoin", t)
+
+    shapes = [ShapeFace(buffer, buffer.faces[targetFace], uvContext) for targetFace, steps in islands]
+    profiler.lap("shaping", t)
+    job = GridJob(me, buffer, uvVerts, islands, shapes, square, uvContext.sizeX/uvContext.sizeY, rejoin, startTime,
+        original, relaxing, uvContext.texel)
+
+    for uv_layer in layers:
+        t = timer()
+        #same loops and islands, the uvs and selection of this layer are its own
+        layerBuffer = buffer.onLayer(uv_layer)
+        layerOriginal = layerBuffer.uv.copy(), layerBuffer.select.copy()
+        layerUvVerts = LinkedUvVerts(layerBuffer, uvVerts.loops)
+        layerUvVerts.group()
+        t = profiler.lap("selection", t)
+
+        layerRejoin = []
+        if noEdge == False:
+            layerRejoin = RejoinPairs(layerBuffer.uv, buffer.vert, edgeVerts, uvVerts.loops, 10 ** -precision)
+        layerRelaxing = None
+        if relaxing != None:
+            layerRelaxing = RelaxConstraints(layerBuffer, nonQuadFaces, layerRejoin) + (relax,)
+        t = profiler.lap("rejoin", t)
+
+        layerShapes = [ShapeFace(layerBuffer, buffer.faces[targetFace], uvContext) for targetFace, steps in islands]
+        profiler.lap("shaping", t)
+        job.layerJobs.append(GridJob(me, layerBuffer, layerUvVerts, islands, layerShapes, square,
+            uvContext.sizeX/uvContext.sizeY, layerRejoin, startTime, layerOriginal, layerRelaxing, uvContext.texel))
+    return job
+
+def RelaxConstraints(buffer, nonQuadFaces, rejoin):
+    """Loops, uv vertices, fixed uv vertices and edges of the selected non quads, for RelaxUvVerts
+
+    A uv vertex is fixed when it was rejoined to a quad or its mesh vert is used by
+    any face that is not one of these non quads, only the inner ones are relaxed.
+    """
+    relaxFaces = set(buffer.faces[f] for f in nonQuadFaces.tolist())
+    loops = np.flatnonzero(np.isin(buffer.face, nonQuadFaces)).astype(np.int32)
+    uvVerts = LinkedUvVerts(buffer, loops.tolist())
+    uvVerts.group()
+    ids = uvVerts.ids[loops]
+
+    inner = {}
+    fixedLoop = np.isin(loops, [ev for ev, i in rejoin])
+    for k, i in enumerate(loops.tolist()):
+        v = buffer.loops[i].vert
+        if v not in inner:
+            inner[v] = all(f in relaxFaces for f in v.link_faces)
+        if not inner[v]: fixedLoop[k] = True
+    fixed = np.zeros(len(uvVerts.start) - 1, dtype=bool)
+    fixed[ids[fixedLoop]] = True
+
+    #each loop and the next one of its face
+    face = buffer.face[loops]
+    after = loops + 1
+    wrap = after == buffer.faceStart[face + 1]
+    after[wrap] = buffer.faceStart[face[wrap]]
+    edges = np.unique(np.sort(np.stack([ids, uvVerts.ids[after]], axis=1), axis=1), axis=0)
+    return loops, ids, fixed, edges
+
+class GridJob:
+    """Array work of squaring the islands of one mesh
+
+    Everything that needs Blender is resolved up front, solving only touches the
+    buffer arrays so islands can be squared in worker processes, finish() writes back.
+    original keeps the uvs and selection as they were read, to solve again or restore.
+    """
+
+    def __init__(self, me, buffer, uvVerts, islands, shapes, square, ratio, rejoin, startTime, original = None, relaxing = None,
+            texel = None):
+        self.me = me
+        self.buffer = buffer
+        self.uvVerts = uvVerts
+        self.islands = islands
+        self.shapes = shapes
+        self.square = square
+        self.ratio = ratio
+        self.rejoin = rejoin
+        self.startTime = startTime
+        self.original = original
+        self.relaxing = relaxing
+        self.texel = texel
+        self.layerJobs = []
+
+    def solve(self):
+        self.solveIslands(range(len(self.islands)))
+        self.solveTexels()
+        self.solveRejoin()
+        self.solveRelax()
+
+    def chunks(self, count):
+        """Island indices split into at most count chunks of about the same number of faces"""
+        sizes = [len(steps[1]) + 1 for targetFace, steps in self.islands]
+        chunks = [[] for i in range(min(count, len(sizes)))]
+        loads = [0] * len(chunks)
+        for i in sorted(range(len(sizes)), key=lambda i: -sizes[i]):
+            least = loads.index(min(loads))
+            chunks[least].append(i)
+            loads[least] += sizes[i]
+        return chunks
+
+    def islandArrays(self, indices):
+        """Islands indices as arrays for SquareIslands"""
         islands = []
-        toCheck = set(selectedFaces)
-        while(len(toCheck)):
-            face = toCheck.pop()
-            island = getIslandFromFace(face)
-            islands.append(island)
-            toCheck.difference_update(island)
+        for i in indices:
+            shape = self.shapes[i]
+            groups = {} if shape == None else {c: self.uvVerts.members(c) for c in shape[:4]}
+            islands.append((shape, groups, self.islands[i][1]))
         return islands
 
-    islands = getIslandsFromSelectedFaces(selFaces)
-
-    def main2 (targetFace, faces):
-        ShapeFace(uv_layer, operator, targetFace, vertsDict, square)
-
-        if square: FollowActiveUV(operator, me, targetFace, faces, 'EVEN')
-        else: FollowActiveUV(operator, me, targetFace, faces)
+    def solveIslands(self, indices):
+        uv, shaping, propagation = SquareIslands(self.buffer.uv, self.islandArrays(indices),
+            self.square, self.ratio, self.texel)
+        profiler.record("shaping", shaping)
+        profiler.record("propagation", propagation)
 
-    for island in islands:
-        targetFace = bm.faces.active
-        if (targetFace == None or
-            targetFace not in island or
-            len(islands) > 1 or
-            targetFace.select == False or
-            len(targetFace.verts) != 4):
-                targetFace = next(iter(island))
-
-        main2(targetFace, island)
-
-    if noEdge == False:
-        #edge has ripped so we connect it back
-        for ev in edgeVerts:
-            key = (round(ev.uv.x, precision), round(ev.uv.y, precision))
-            if key in vertsDict:
-                ev.uv = vertsDict[key][0].uv
-                ev.select = True
+    def submitIslands(self, pool, indices):
+        """Sends islands indices with only their uvs to a worker process of the WorkerPool pool
 
-    return SuccessFinished(me, startTime)
+        Returns a function that waits for the worker and puts the squared uvs back.
+        """
+        loops, islands = IslandsOnOwnLoops(self.islandArrays(indices))
+        future = pool.submit(pool.engine.SquareIslands, self.buffer.uv[loops], islands,
+            self.square, self.ratio, self.texel)
+
+        def receive():
+            uv, shaping, propagation = future.result()
+            self.buffer.uv[loops] = uv
+            profiler.record("shaping", shaping)
+            profiler.record("propagation", propagation)
+        return receive
+
+    def solveTexels(self):
+        """Snaps the squared quads to the texel grid, the rejoined verts follow them"""
+        if self.texel is None: return
+        t = timer()
+        SnapToTexels(self.buffer.uv, self.uvVerts.loops, self.texel)
+        profiler.lap("shaping", t)
+
+    def solveRejoin(self):
+        t = timer()
+        uv = self.buffer.uv
+        for ev, i in self.rejoin:
+            uv[ev] = uv[i]
+            self.buffer.select[ev] = True
+        profiler.lap("rejoin", t)
+
+    def solveRelax(self):
+        """Relaxes the inner verts of the non quads between the squared quads"""
+        if self.relaxing == None: return
+        t = timer()
+        RelaxUvVerts(self.buffer.uv, *self.relaxing)
+        profiler.lap("relax", t)
+
+    def finish(self):
+        t = timer()
+        uvHistory.record(self.me, self.buffer, self.original)
+        self.buffer.write()
+        profiler.lap("update", t)
+        return SuccessFinished(self.me, self.startTime)
 
 '''def ScaleSelection(factor, pivot = 'CURSOR'):
     last_pivot = bpy.context.space_data.pivot_point
@@ -160,173 +399,308 @@ def main1(obj, context, operator, square, snapToClosest):
     bpy.context.space_data.pivot_point = last_pivot
     return'''
 
-def ShapeFace(uv_layer, operator, targetFace, vertsDict, square):
-    corners = []
-    for l in targetFace.loops:
-        luv = l[uv_layer]
-        corners.append(luv)
+def ShapeFace(buffer, targetFace, uvContext):
+    """Corners of targetFace and the one closest to the cursor, for MakeUvFaceEqualRectangle"""
+    corners = list(buffer.faceLoops(targetFace))
 
     if len(corners) != 4:
         #operator.report({'ERROR'}, "bla")
-        return
+        return None
 
-    lucv, ldcv, rucv, rdcv = Corners(corners)
+    uv = buffer.uv
+    lucv, ldcv, rucv, rdcv = Corners(uv, corners)
 
-    cct = CursorClosestTo([lucv, ldcv, rdcv, rucv])
-    MakeUvFaceEqualRectangle(vertsDict, lucv, rucv, rdcv, ldcv, cct, square)
-    return
-
-def MakeUvFaceEqualRectangle(vertsDict, lucv, rucv, rdcv, ldcv, startv, square = False):
-    sizeX, sizeY = ImageSize()
-    ratio = sizeX/sizeY
-
-    if startv == None: startv = lucv.uv
-    elif AreVertsQuasiEqual(startv, rucv): startv = rucv.uv
-    elif AreVertsQuasiEqual(startv, rdcv): startv = rdcv.uv
-    elif AreVertsQuasiEqual(startv, ldcv): startv = ldcv.uv
-    else: startv = lucv.uv
-
-    lucv = lucv.uv
-    rucv = rucv.uv
-    rdcv = rdcv.uv
-    ldcv = ldcv.uv
-
-    if (startv == lucv):
-        finalScaleX = hypotVert(lucv, rucv)
-        finalScaleY = hypotVert(lucv, ldcv)
-        currRowX = lucv.x
-        currRowY = lucv.y
-
-    elif (startv == rucv):
-        finalScaleX = hypotVert(rucv, lucv)
-        finalScaleY = hypotVert(rucv, rdcv)
-        currRowX = rucv.x - finalScaleX
-        currRowY = rucv.y
-
-    elif (startv == rdcv):
-        finalScaleX = hypotVert(rdcv, ldcv)
-        finalScaleY = hypotVert(rdcv, rucv)
-        currRowX = rdcv.x - finalScaleX
-        currRowY = rdcv.y + finalScaleY
+    cct = ClosestTo(uv, [lucv, ldcv, rdcv, rucv], uvContext.cursors)
+    return lucv, rucv, rdcv, ldcv, cct
 
-    else:
-        finalScaleX = hypotVert(ldcv, rdcv)
-        finalScaleY = hypotVert(ldcv, lucv)
-        currRowX = ldcv.x
-        currRowY = ldcv.y +finalScaleY
-
-    if square: finalScaleY = finalScaleX*ratio
-    #lucv, rucv
-    x = round(lucv.x, precision)
-    y = round(lucv.y, precision)
-    for v in vertsDict[(x,y)]:
-        v.uv.x = currRowX
-        v.uv.y = currRowY
-
-    x = round(rucv.x, precision)
-    y = round(rucv.y, precision)
-    for v in vertsDict[(x,y)]:
-        v.uv.x = currRowX + finalScaleX
-        v.uv.y = currRowY
-
-    #rdcv, ldcv
-    x = round(rdcv.x, precision)
-    y = round(rdcv.y, precision)
-    for v in vertsDict[(x,y)]:
-        v.uv.x = currRowX + finalScaleX
-        v.uv.y = currRowY - finalScaleY
-
-    x = round(ldcv.x, precision)
-    y = round(ldcv.y, precision)
-    for v in vertsDict[(x,y)]:
-        v.uv.x = currRowX
-        v.uv.y = currRowY - finalScaleY
-
-
-    return
-
-def SnapCursorToClosestSelected(filteredVerts):
+def SnapCursorToClosestSelected(uv, filteredVerts, uvContext):
     #TODO: snap to closest selected
     if len(filteredVerts) == 1:
-        SetAll2dCursorsTo(filteredVerts[0].uv.x, filteredVerts[0].uv.y)
+        SetAll2dCursorsTo(uvContext, *uv[filteredVerts[0]].tolist())
 
     return
 
-def ListsOfVerts(uv_layer, bm):
-    edgeVerts = []
-    allEdgeVerts = []
-    filteredVerts = []
-    selFaces = []
-    nonQuadFaces = []
-    vertsDict = defaultdict(list)                #dict
+class UvLoopBuffer:
+    """Uvs, selection and topology of the loops of given faces as flat arrays
 
-    for f in bm.faces:
-        isFaceSel = True
-        facesEdgeVerts = []
-        if (f.select == False):
-            continue
+    Uvs are read once on creation, helpers work on loop indices into the buffer
+    instead of BMLoopUV wrappers and everything is written back with write().
+    """
 
-        #collect edge verts if any
-        for l in f.loops:
+    def __init__(self, bm, uv_layer, faces):
+        bm.verts.index_update()
+        bm.edges.index_update()
+        bm.faces.index_update()
+        self.uv_layer = uv_layer
+        self.faces = faces
+        self.faceIndex = {f: i for i, f in enumerate(faces)}
+        self.loops = [l for f in faces for l in f.loops]
+        self.loopIndex = {l: i for i, l in enumerate(self.loops)}
+        self.read()
+        self.vert = np.array([l.vert.index for l in self.loops], dtype=np.int32)
+        self.edge = np.array([l.edge.index for l in self.loops], dtype=np.int32)
+        self.seam = np.array([l.edge.seam for l in self.loops], dtype=bool)
+        self.face = np.repeat(np.arange(len(faces), dtype=np.int32), [len(f.loops) for f in faces])
+        self.faceStart = np.zeros(len(faces) + 1, dtype=np.int32)
+        np.cumsum([len(f.loops) for f in faces], out=self.faceStart[1:])
+
+    def read(self):
+        luvs = [l[self.uv_layer] for l in self.loops]
+        self.uv = np.array([c for luv in luvs for c in luv.uv], dtype=np.float32).reshape(-1, 2)
+        self.select = np.array([luv.select for luv in luvs], dtype=bool)
+
+    def onLayer(self, uv_layer):
+        """Buffer of the same loops and topology with the uvs and selection of another uv layer"""
+        buffer = copy.copy(self)
+        buffer.uv_layer = uv_layer
+        buffer.read()
+        return buffer
+
+    def fullySelected(self):
+        """Mask of the faces with all their loops selected"""
+        return np.logical_and.reduceat(self.select, self.faceStart[:-1])
+
+    def selectedQuads(self):
+        """Mask of the fully selected quads, the faces that are squared"""
+        return self.fullySelected() & (np.diff(self.faceStart) == 4)
+
+    def faceLoops(self, f):
+        """Indices of the loops of face f"""
+        i = self.faceIndex[f]
+        return range(int(self.faceStart[i]), int(self.faceStart[i + 1]))
+
+    def write(self, indices = None):
+        """Writes uvs and selection back, of all loops or only of the loop indices given"""
+        uv_layer = self.uv_layer
+        loops, uvs, selects = self.loops, self.uv, self.select
+        if indices is not None:
+            loops = [loops[i] for i in indices.tolist()]
+            uvs, selects = uvs[indices], selects[indices]
+        for l, uv, select in zip(loops, uvs.tolist(), selects.tolist()):
             luv = l[uv_layer]
-            if luv.select == True:
-                facesEdgeVerts.append(luv)
-            else: isFaceSel = False
-
-        allEdgeVerts.extend(facesEdgeVerts)
-        if isFaceSel:
-            if len(f.verts) != 4:
-                nonQuadFaces.append(f)
-                edgeVerts.extend(facesEdgeVerts)
-            else:
-                selFaces.append(f)
+            luv.uv = uv
+            luv.select = select
+
+def SelectionBuffer(bm, uv_layer):
+    """UvLoopBuffer of the faces shown in the UV editor
+
+    Only faces selected in the mesh show up in the UV editor, so this is the one
+    pass over all faces, everything after it works on the loops of the buffer.
+    """
+    return UvLoopBuffer(bm, uv_layer, [f for f in bm.faces if f.select])
+
+def IslandChunks(bm, uv_layer, chunkFaces):
+    """Faces of chunks of whole islands, about chunkFaces faces each, for the low memory mode
+
+    Returns (face indices, island count) per chunk, the indices as an np.int32 array.
+    One pass over the mesh keeps only integer arrays of the fully selected quads, the
+    loops of a chunk are read when it is squared. Other selected faces go with every
+    chunk they share a vert with, so their ripped edge verts are rejoined. Empty when
+    no quads are selected.
+    """
+    bm.verts.index_update()
+    bm.edges.index_update()
+    bm.faces.index_update()
+    bm.faces.ensure_lookup_table()
+
+    quads = array('i')
+    quadVerts = array('i')
+    loopFace = array('i')
+    loopEdge = array('i')
+    #selected verts of the other faces, with their face
+    otherVerts = array('i')
+    otherFaces = array('i')
+    for f in bm.faces:
+        if not f.select: continue
+        selected = [l[uv_layer].select for l in f.loops]
+        if len(selected) == 4 and all(selected):
+            for l in f.loops:
+                if not l.edge.seam:
+                    loopFace.append(len(quads))
+                    loopEdge.append(l.edge.index)
+                quadVerts.append(l.vert.index)
+            quads.append(f.index)
+        elif any(selected):
+            for l, select in zip(f.loops, selected):
+                if select:
+                    otherVerts.append(l.vert.index)
+                    otherFaces.append(f.index)
+
+    quads = np.frombuffer(quads, dtype=np.int32)
+    labels = IslandLabels(np.ones(len(quads), dtype=bool),
+        np.frombuffer(loopFace, dtype=np.int32), np.frombuffer(loopEdge, dtype=np.int32))
+    #quads island after island, a chunk is a slice of them
+    order = np.argsort(labels, kind='stable')
+    quads = quads[order]
+    quadVerts = np.frombuffer(quadVerts, dtype=np.int32).reshape(-1, 4)[order]
+    otherVerts = np.frombuffer(otherVerts, dtype=np.int32)
+    otherFaces = np.frombuffer(otherFaces, dtype=np.int32)
+
+    chunks = []
+    start = end = islandCount = 0
+    for size in np.bincount(labels).tolist():
+        end += size
+        islandCount += 1
+        if end - start >= chunkFaces or end == len(quads):
+            faces = quads[start:end]
+            if len(otherFaces) > 0:
+                touching = otherFaces[np.isin(otherVerts, quadVerts[start:end])]
+                faces = np.union1d(faces, touching).astype(np.int32)
+            chunks.append((faces, islandCount))
+            start = end
+            islandCount = 0
+    return chunks
+
+class IslandCache:
+    """Islands with their FollowActiveSteps and the UvVerts of their quads from recent runs, per mesh
+
+    Entries are keyed on topology counts, selected quads and the active face, they are
+    dropped on geometry updates of their mesh that were not our own uv writes and
+    the least recently used entry is evicted once there are more than size. The
+    EdgeRings of a mesh are kept the same way, one per mesh.
+    """
+
+    def __init__(self, size = 16):
+        self.size = size
+        self.entries = OrderedDict()
+        self.edgeRings = OrderedDict()
+        self.ownUpdates = set()
+
+    def key(self, me, bm, buffer, extendMode):
+        active = bm.faces.active
+        return (me.as_pointer(),
+                len(bm.verts), len(bm.edges), len(bm.faces),
+                hash(np.array([f.index for f in buffer.faces], dtype=np.int32).tobytes()),
+                hash(buffer.selectedQuads().tobytes()),
+                active.index if active != None else -1,
+                extendMode)
+
+    def get(self, key):
+        islands = self.entries.get(key)
+        if islands != None:
+            self.entries.move_to_end(key)
+        return islands
 
-                for l in f.loops:
-                    luv = l[uv_layer]
-                    x = round(luv.uv.x, precision)
-                    y = round(luv.uv.y, precision)
-                    vertsDict[(x, y)].append(luv)
+    def put(self, key, islands):
+        self.entries[key] = islands
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def rings(self, me, bm):
+        """EdgeRings of me, shared by all its islands until its geometry changes"""
+        key = (me.as_pointer(), len(bm.verts), len(bm.edges), len(bm.faces))
+        rings = self.edgeRings.get(key[0])
+        if rings == None or rings.key != key:
+            rings = EdgeRings(key, len(bm.edges))
+            self.edgeRings[key[0]] = rings
+        self.edgeRings.move_to_end(key[0])
+        while len(self.edgeRings) > self.size:
+            self.edgeRings.popitem(last=False)
+        return rings
+
+    def written(self, me):
+        """Skip the next geometry update of me, it only carries our uv changes"""
+        self.ownUpdates.add(me.as_pointer())
+
+    def invalidate(self, mesh):
+        if mesh in self.ownUpdates:
+            self.ownUpdates.discard(mesh)
+            return
+        for key in [key for key in self.entries if key[0] == mesh]:
+            del self.entries[key]
+        self.edgeRings.pop(mesh, None)
+
+    def clear(self):
+        self.entries.clear()
+        self.edgeRings.clear()
+        self.ownUpdates.clear()
+
+islandCache = IslandCache()
+
+def ListsOfVerts(buffer, uvVerts = None):
+    """Selected loops of the buffer sorted out for squaring
+
+    selFaces and nonQuadFaces are indices of the fully selected quads and other
+    faces, quads the mask of selFaces over all faces of the buffer and edgeVerts
+    the selected loops that are not in one of the quads. uvVerts of the quads
+    from islandCache are used instead of linking them again.
+    """
+    full = buffer.fullySelected()
+    quads = buffer.selectedQuads()
+    inQuad = quads[buffer.face]
+
+    selFaces = np.flatnonzero(quads)
+    nonQuadFaces = np.flatnonzero(full & ~quads)
+    quadLoops = np.flatnonzero(inQuad).tolist()
 
-        else: edgeVerts.extend(facesEdgeVerts)
+    #collect edge verts if any
+    edgeVerts = np.flatnonzero(buffer.select & ~inQuad).tolist()
 
     noEdge = False
     if len(edgeVerts) == 0:
         noEdge = True
-        edgeVerts.extend(allEdgeVerts)
+        edgeVerts = np.flatnonzero(buffer.select).tolist()
 
     if len(selFaces) == 0:
-        for ev in edgeVerts:
-            if ListQuasiContainsVect(filteredVerts, ev) == False:
-                filteredVerts.append(ev)
-    else: filteredVerts = edgeVerts
-
-    return edgeVerts, filteredVerts, selFaces, nonQuadFaces, vertsDict, noEdge
-
-def ListQuasiContainsVect(list, vect):
-    for v in list:
-        if AreVertsQuasiEqual(v, vect):
-            return True
-    return False
+        #selected verts of a line, the ones sitting on the same spot move together
+        uvVerts = LinkedUvVerts(buffer, edgeVerts)
+        filteredVerts = JoinCoincident(buffer.uv, edgeVerts, uvVerts)
+    else:
+        if uvVerts == None: uvVerts = LinkedUvVerts(buffer, quadLoops)
+        filteredVerts = edgeVerts
+
+    if uvVerts.ids is None: uvVerts.group()
+    return edgeVerts, filteredVerts, selFaces, nonQuadFaces, uvVerts, noEdge, quads
+
+def LinkedUvVerts(buffer, loops):
+    """UvVerts of loops, joined where they use the same mesh vertex, share a non seam edge and their uvs coincide"""
+    uvVerts = UvVerts(len(buffer.loops), loops)
+
+    inLoops = [False] * len(buffer.loops)
+    for i in loops:
+        inLoops[i] = True
+
+    uvs = buffer.uv.tolist()
+    loopIndex = buffer.loopIndex
+    connectLimit = 10 ** -precision
+    for i in loops:
+        l = buffer.loops[i]
+        if l.edge.seam: continue
+
+        #loops of the other faces on this edge, at both of its verts
+        r = l.link_loop_radial_next
+        while r != l:
+            for a in (l, l.link_loop_next):
+                b = r if r.vert == a.vert else r.link_loop_next
+                ia = loopIndex[a]
+                ib = loopIndex.get(b)
+                if (ib != None and inLoops[ia] and inLoops[ib] and
+                    AreVertsQuasiEqual(uvs[ia], uvs[ib], connectLimit)):
+                        uvVerts.join(ia, ib)
+            r = r.link_loop_radial_next
+    return uvVerts
 
 #modified ideasman42's uvcalc_follow_active.py
-def FollowActiveUV(operator, me, f_act, faces, EXTEND_MODE = 'LENGTH_AVERAGE'):
-    bm = bmesh.from_edit_mesh(me)
-    uv_act = bm.loops.layers.uv.active
-
-    # our own local walker
-    def walk_face_init(faces, f_act):
-        # first tag all faces True (so we dont uvmap them)
-        for f in bm.faces:
-            f.tag = True
-        # then tag faces arg False
-        for f in faces:
-            f.tag = False
-        # tag the active face True since we begin there
-        f_act.tag = True
+def FollowActiveSteps(bm, loopIndex, f_act, faces, EXTEND_MODE = 'LENGTH_AVERAGE', rings = None):
+    """Walks faces from f_act and returns the copy steps as integer arrays
+
+    steps holds the buffer indices of l_a and l_b loops (see apply_uv) per walked face,
+    facs the extrapolation factor of each step and rows the offsets where the next
+    row of faces (one more step away from f_act) begins. rings are the EdgeRings of
+    the mesh for LENGTH_AVERAGE, they are made for this call when not given.
+    """
+    steps = []
+    facs = []
+    depths = []
+    depth = {f_act: 0}
+
+    # our own local walker, faces of the island it did not reach yet
+    # are kept in a set so nothing outside of the island is touched
+    unvisited = set(faces)
 
     def walk_face(f):
-        # all faces in this list must be tagged
-        f.tag = True
+        unvisited.discard(f)
         faces_a = [f]
         faces_b = []
 
@@ -337,43 +711,14 @@ def FollowActiveUV(operator, me, f_act, faces, EXTEND_MODE = 'LENGTH_AVERAGE'):
                     if (l_edge.is_manifold == True) and (l_edge.seam == False):
                         l_other = l.link_loop_radial_next
                         f_other = l_other.face
-                        if not f_other.tag:
+                        if f_other in unvisited:
                             yield (f, l, f_other)
-                            f_other.tag = True
+                            unvisited.discard(f_other)
                             faces_b.append(f_other)
             # swap
             faces_a, faces_b = faces_b, faces_a
             faces_b.clear()
 
-    def walk_edgeloop(l):
-        """
-        Could make this a generic function
-        """
-        e_first = l.edge
-        e = None
-        while True:
-            e = l.edge
-            yield e
-
-            # don't step past non-manifold edges
-            if e.is_manifold:
-                # welk around the quad and then onto the next face
-                l = l.link_loop_radial_next
-                if len(l.face.verts) == 4:
-                    l = l.link_loop_next.link_loop_next
-                    if l.edge == e_first:
-                        break
-                else:
-                    break
-            else:
-                break
-
-    def extrapolate_uv(fac,
-                       l_a_outer, l_a_inner,
-                       l_b_outer, l_b_inner):
-        l_b_inner[:] = l_a_inner
-        l_b_outer[:] = l_a_inner + ((l_a_inner - l_a_outer) * fac)
-
     def apply_uv(f_prev, l_prev, f_next):
         l_a = [None, None, None, None]
         l_b = [None, None, None, None]
@@ -411,12 +756,9 @@ def FollowActiveUV(operator, me, f_act, faces, EXTEND_MODE = 'LENGTH_AVERAGE'):
             l_b[2] = l_b[1].link_loop_next
             l_b[3] = l_b[2].link_loop_next
 
-        l_a_uv = [l[uv_act].uv for l in l_a]
-        l_b_uv = [l[uv_act].uv for l in l_b]
-
         if EXTEND_MODE == 'LENGTH_AVERAGE':
             try:
-                fac = edge_lengths[l_b[2].edge.index][0] / edge_lengths[l_a[1].edge.index][0]
+                fac = rings.ringAverage(l_b[2].edge) / rings.ringAverage(l_a[1].edge)
             except ZeroDivisionError:
                 fac = 1.0
         elif EXTEND_MODE == 'LENGTH':
@@ -432,21 +774,57 @@ def FollowActiveUV(operator, me, f_act, faces, EXTEND_MODE = 'LENGTH_AVERAGE'):
         else:
             fac = 1.0
 
-        extrapolate_uv(fac,
-                       l_a_uv[3], l_a_uv[0],
-                       l_b_uv[3], l_b_uv[0])
-
-        extrapolate_uv(fac,
-                       l_a_uv[2], l_a_uv[1],
-                       l_b_uv[2], l_b_uv[1])
+        steps.extend(loopIndex[l] for l in l_a)
+        steps.extend(loopIndex[l] for l in l_b)
+        facs.append(fac)
+        depth[f_next] = depth[f_prev] + 1
+        depths.append(depth[f_next])
 
     # -------------------------------------------
     # Calculate average length per loop if needed
 
+    if rings == None:
+        rings = EdgeRings(None, len(bm.edges))
     if EXTEND_MODE == 'LENGTH_AVERAGE':
-        bm.edges.index_update()
-        edge_lengths = [None] * len(bm.edges)   #NoneType times the length of edges list
+        rings.walk(faces)
+
+    # done with average length
+    # ------------------------
+
+    for f_triple in walk_face(f_act):
+        apply_uv(*f_triple)
 
+    rows = [0] + (np.flatnonzero(np.diff(depths)) + 1).tolist() + [len(depths)]
+    return (np.array(steps, dtype=np.int32).reshape(-1, 8),
+            np.array(facs, dtype=np.float32),
+            rows)
+
+class EdgeRings:
+    """Edge rings of a mesh with their average edge length, walked as islands need them
+
+    ring holds the ring of every edge (-1 until it is walked), average the average
+    edge length of every ring and length the length of every edge (nan until it is
+    needed). IslandCache keeps them per mesh until its geometry changes.
+    """
+
+    def __init__(self, key, edgeCount):
+        self.key = key
+        self.ring = np.full(edgeCount, -1, dtype=np.int32)
+        self.length = np.full(edgeCount, np.nan)
+        self.average = []
+
+    def edgeLength(self, e):
+        length = self.length[e.index]
+        if length != length:
+            length = self.length[e.index] = e.calc_length()
+        return float(length)
+
+    def ringAverage(self, e):
+        return self.average[self.ring[e.index]]
+
+    def walk(self, faces):
+        """Walks the rings through both pairs of opposite edges of the quads in faces"""
+        ring = self.ring
         for f in faces:
             # we know its a quad
             l_quad = f.loops[:]
@@ -454,42 +832,298 @@ def FollowActiveUV(operator, me, f_act, faces, EXTEND_MODE = 'LENGTH_AVERAGE'):
             l_pair_b = (l_quad[1], l_quad[3])
 
             for l_pair in (l_pair_a, l_pair_b):
-                if edge_lengths[l_pair[0].edge.index] == None:
-
-                    edge_length_store = [-1.0]
+                if ring[l_pair[0].edge.index] == -1:
+                    r = len(self.average)
                     edge_length_accum = 0.0
                     edge_length_total = 0
 
                     for l in l_pair:
-                        if edge_lengths[l.edge.index] == None:
-                            for e in walk_edgeloop(l):
-                                if edge_lengths[e.index] == None:
-                                    edge_lengths[e.index] = edge_length_store
-                                    edge_length_accum += e.calc_length()
+                        if ring[l.edge.index] == -1:
+                            for e in WalkEdgeRing(l):
+                                if ring[e.index] == -1:
+                                    ring[e.index] = r
+                                    edge_length_accum += self.edgeLength(e)
                                     edge_length_total += 1
 
-                    edge_length_store[0] = edge_length_accum / edge_length_total
-
-    # done with average length
-    # ------------------------
-
-    walk_face_init(faces, f_act)
-    for f_triple in walk_face(f_act):
-        apply_uv(*f_triple)
-
-    bmesh.update_edit_mesh(me, loop_triangles=False)
+                    self.average.append(edge_length_accum / edge_length_total)
+
+def WalkEdgeRing(l):
+    """Edges across the quads from l.edge, until a non manifold edge, a non quad or back at l.edge"""
+    e_first = l.edge
+    e = None
+    while True:
+        e = l.edge
+        yield e
+
+        # don't step past non-manifold edges
+        if e.is_manifold:
+            # welk around the quad and then onto the next face
+            l = l.link_loop_radial_next
+            if len(l.face.verts) == 4:
+                l = l.link_loop_next.link_loop_next
+                if l.edge == e_first:
+                    break
+            else:
+                break
+        else:
+            break
 
 '''----------------------------------'''
 
 def SuccessFinished(me, startTime):
     #use for backtrack of steps
     #bpy.ops.ed.undo_push()
-    bmesh.update_edit_mesh(me)
+    meshUpdates.add(me)
     elapsed = round(timer()-startTime, 2)
     #if (elapsed >= 0.05): operator.report({'INFO'}, "UvSquares finished, elapsed:", elapsed, "s.")
     if (elapsed >= 0.05): print("UvSquares finished, elapsed:", elapsed, "s.")
     return
 
+class Profiler:
+    """Wall time per phase and counts of one operator run
+
+    Phases that run in worker processes are summed over the workers. stop() returns
+    the result of the run and keeps it as last, for the panel.
+    """
+    phases = ("selection", "islands", "shaping", "propagation", "rejoin", "relax", "update")
+
+    def __init__(self):
+        self.lock = Lock()
+        self.last = None
+        self.start()
+
+    def start(self, traceMemory = False):
+        self.startTime = timer()
+        self.times = {phase: 0.0 for phase in self.phases}
+        self.counts = {"objects": 0, "faces": 0, "loops": 0, "islands": 0}
+        self.traceMemory = traceMemory and not tracemalloc.is_tracing()
+        if self.traceMemory: tracemalloc.start()
+
+    def record(self, phase, seconds):
+        with self.lock:
+            self.times[phase] += seconds
+
+    def lap(self, phase, since):
+        """Records the time since since to phase and returns the current time"""
+        now = timer()
+        self.record(phase, now - since)
+        return now
+
+    def count(self, **counts):
+        with self.lock:
+            for name, count in counts.items():
+                self.counts[name] += count
+
+    def stop(self):
+        self.last = {"total": timer() - self.startTime,
+            "phases": dict(self.times), "counts": dict(self.counts)}
+        if self.traceMemory:
+            self.last["peak_mb"] = tracemalloc.get_traced_memory()[1] / 2**20
+            tracemalloc.stop()
+            self.traceMemory = False
+        return self.last
+
+    def summary(self):
+        last = self.last
+        summary = "UvSquares %.1f ms (%s), %s" % (last["total"] * 1000,
+            ", ".join("%s %.1f" % (phase, seconds * 1000) for phase, seconds in last["phases"].items()),
+            ", ".join("%d %s" % (count, name) for name, count in last["counts"].items()))
+        if "peak_mb" in last:
+            summary += ", peak %.1f MB" % last["peak_mb"]
+        return summary
+
+profiler = Profiler()
+
+class WorkerPool:
+    """Worker processes for SolveJobs, started with the pool and kept until unregister
+
+    Workers import uv_squares_engine as a top level module from the addon folder, the
+    addon package imports bpy which only exists in Blender itself. Only the workers put
+    the folder on sys.path, Blender gets the engine under that name in sys.modules for
+    as long as the pool runs. They start from a fork server (spawn on Windows), so
+    Blender is never forked.
+    """
+
+    def __init__(self):
+        self.pool = None
+        self.workers = 0
+        self.engine = None
+        self.ownEngine = False
+
+    def start(self, workers):
+        if self.pool == None or self.workers != workers:
+            self.shutdown()
+            folder = os.path.dirname(os.path.abspath(__file__))
+            #tasks are pickled by module name, which has to be found in sys.modules
+            self.engine = sys.modules.get("uv_squares_engine")
+            self.ownEngine = self.engine == None
+            if self.ownEngine:
+                spec = importlib.util.spec_from_file_location("uv_squares_engine", os.path.join(folder, "uv_squares_engine.py"))
+                self.engine = importlib.util.module_from_spec(spec)
+                spec.loader.exec_module(self.engine)
+                sys.modules["uv_squares_engine"] = self.engine
+
+            if "forkserver" in multiprocessing.get_all_start_methods():
+                mpContext = multiprocessing.get_context("forkserver")
+                mpContext.set_forkserver_preload(["numpy"])
+            else: mpContext = multiprocessing.get_context("spawn")
+            self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=mpContext,
+                initializer=site.addsitedir, initargs=(folder,))
+            self.workers = workers
+
+            #workers would run the __main__ script again (blender -P) to set up, but
+            #only need the engine. They start on demand, one task each makes all start
+            #now, as none can finish before the last is submitted.
+            main = sys.modules["__main__"]
+            path = main.__dict__.pop("__file__", None)
+            try:
+                for started in [self.pool.submit(os.getpid) for i in range(workers)]:
+                    started.result()
+            finally:
+                if path != None: main.__file__ = path
+        return self
+
+    def submit(self, fn, *args):
+        return self.pool.submit(fn, *args)
+
+    def shutdown(self):
+        if self.pool != None:
+            self.pool.shutdown()
+            self.pool = None
+        if self.ownEngine:
+            sys.modules.pop("uv_squares_engine", None)
+            self.ownEngine = False
+
+workerPool = WorkerPool()
+
+class MeshUpdates:
+    """Edit meshes changed during an operator run, flush() updates each of them once
+
+    With uvOnly the loop triangles and normals are not recalculated, only uvs and
+    selection changed so the tessellation is still valid.
+    """
+
+    def __init__(self):
+        self.meshes = OrderedDict()
+
+    def add(self, me):
+        self.meshes[me.as_pointer()] = me
+
+    def flush(self, uvOnly = True):
+        for me in self.meshes.values():
+            islandCache.written(me)
+            if uvOnly:
+                bmesh.update_edit_mesh(me, loop_triangles=False, destructive=False)
+            else: bmesh.update_edit_mesh(me)
+        self.meshes.clear()
+
+meshUpdates = MeshUpdates()
+
+class UvHistory:
+    """Uvs and selection of the loops changed by the last operator runs, for RevertLast
+
+    Only the touched loops are kept, as face index and corner with float32 uvs.
+    Records of one run are collected and commit() makes them one step, the oldest
+    steps are dropped when there are more than maxSteps or they take more than maxMb.
+    """
+
+    def __init__(self):
+        self.steps = []
+        self.pending = []
+        self.bytes = 0
+
+    def record(self, me, buffer, original):
+        """Keeps the original uvs and selection of the loops of buffer that changed"""
+        uv, select = original
+        touched = np.flatnonzero((buffer.uv != uv).any(axis=1) | (buffer.select != select))
+        if len(touched) == 0: return
+
+        bm = bmesh.from_edit_mesh(me)
+        face = buffer.face[touched]
+        faces = np.fromiter((f.index for f in buffer.faces), np.int32, len(buffer.faces))[face]
+        corners = (touched - buffer.faceStart[face]).astype(np.int32)
+        self.pending.append((me, (len(bm.verts), len(bm.edges), len(bm.faces)), buffer.uv_layer.name,
+            faces, corners, uv[touched], select[touched]))
+
+    def commit(self, maxSteps, maxMb):
+        if len(self.pending) > 0:
+            self.steps.append(self.pending)
+            self.bytes += self.size(self.pending)
+        self.pending = []
+        while len(self.steps) > 0 and (len(self.steps) > maxSteps or self.bytes > maxMb * 2**20):
+            self.bytes -= self.size(self.steps.pop(0))
+
+    def size(self, step):
+        return sum(faces.nbytes + corners.nbytes + uv.nbytes + select.nbytes
+            for me, key, layer, faces, corners, uv, select in step)
+
+    def revert(self):
+        """Writes back the last step, returns the number of meshes that left edit mode, were removed or changed topology since"""
+        step = self.steps.pop()
+        self.bytes -= self.size(step)
+        skipped = 0
+        #later records of a mesh were read after the earlier ones wrote
+        for me, key, layer, faces, corners, uv, select in reversed(step):
+            try:
+                editing = me.is_editmode
+            except ReferenceError:
+                editing = False
+            if not editing:
+                skipped += 1
+                continue
+
+            bm = bmesh.from_edit_mesh(me)
+            uv_layer = bm.loops.layers.uv.get(layer)
+            if key != (len(bm.verts), len(bm.edges), len(bm.faces)) or uv_layer == None:
+                skipped += 1
+                continue
+
+            bm.faces.ensure_lookup_table()
+            bmFaces = bm.faces
+            for f, c, co, s in zip(faces.tolist(), corners.tolist(), uv.tolist(), select.tolist()):
+                luv = bmFaces[f].loops[c][uv_layer]
+                luv.uv = co
+                luv.select = s
+            meshUpdates.add(me)
+        return skipped
+
+    def clear(self):
+        self.steps.clear()
+        self.pending = []
+        self.bytes = 0
+
+uvHistory = UvHistory()
+
+def FinishRun(operator, context):
+    """Updates the meshes edited by the operator run and reports its profile
+
+    The operators leave undo to this, a step is only pushed when the Undo Steps
+    setting is on, otherwise the uv history alone can revert the run.
+    """
+    settings = context.scene.uv_squares
+    t = timer()
+    uvHistory.commit(settings.history_steps, settings.history_mb)
+    meshUpdates.flush(settings.uv_only_update)
+    UndoPush(operator, context)
+    profiler.lap("update", t)
+    result = profiler.stop()
+
+    if settings.profile:
+        operator.report({'INFO'}, profiler.summary())
+        if settings.profile_log != "":
+            result = dict(result, operator=operator.bl_idname, file=bpy.data.filepath)
+            try:
+                with open(bpy.path.abspath(settings.profile_log), "a") as f:
+                    f.write(json.dumps(result) + "\n")
+            except OSError as e:
+                operator.report({'WARNING'}, "Could not write profile log: %s" % e)
+    return {'FINISHED'}
+
+def UndoPush(operator, context):
+    #a step of the undo history copies the whole edit mesh
+    if context.scene.uv_squares.undo_push:
+        bpy.ops.ed.undo_push(message=operator.bl_label)
+
 '''def SymmetrySelected(axis, pivot = "MEDIAN"):
     last_pivot = bpy.context.space_data.pivot_point
     bpy.context.space_data.pivot_point = pivot
@@ -497,111 +1131,18 @@ def SuccessFinished(me, startTime):
     bpy.context.space_data.pivot_point = last_pivot
     return'''
 
-def AreVectsLinedOnAxis(verts):
-    areLinedX = True
-    areLinedY = True
-    allowedError = 0.00001
-    valX = verts[0].uv.x
-    valY = verts[0].uv.y
-    for v in verts:
-        if abs(valX - v.uv.x) > allowedError:
-            areLinedX = False
-        if abs(valY - v.uv.y) > allowedError:
-            areLinedY = False
-    return areLinedX or areLinedY
-
-def MakeEqualDistanceBetweenVertsInLine(filteredVerts, vertsDict, startv = None):
-    verts = filteredVerts
-    verts.sort(key=lambda x: x.uv[0])      #sort by .x
-
-    first = verts[0].uv
-    last = verts[len(verts)-1].uv
-
-    horizontal = True
-    if ((last.x - first.x) >0.00001):
-        slope = (last.y - first.y)/(last.x - first.x)
-        if (slope > 1) or (slope <-1):
-            horizontal = False
-    else:
-        horizontal = False
-
-    if horizontal == True:
-        length = hypot(first.x - last.x, first.y - last.y)
-
-        if startv == last:
-            currentX = last.x - length
-            currentY = last.y
-        else:
-            currentX = first.x
-            currentY = first.y
-    else:
-        verts.sort(key=lambda x: x.uv[1])  #sort by .y
-        verts.reverse()     #reverse because y values drop from up to down
-        first = verts[0].uv
-        last = verts[len(verts)-1].uv
-
-        length = hypot(first.x - last.x, first.y - last.y)  # we have to call length here because if it is not Hor first and second can not actually be first and second
-
-        if startv == last:
-            currentX = last.x
-            currentY = last.y + length
-
-        else:
-            currentX = first.x
-            currentY = first.y
-
-    numberOfVerts = len(verts)
-    finalScale = length / (numberOfVerts-1)
-
-    if horizontal == True:
-        first = verts[0]
-        last = verts[len(verts)-1]
-
-        for v in verts:
-            v = v.uv
-            x = round(v.x, precision)
-            y = round(v.y, precision)
-
-            for vert in vertsDict[(x,y)]:
-                vert.uv.x = currentX
-                vert.uv.y = currentY
-
-            currentX = currentX + finalScale
-    else:
-        for v in verts:
-            x = round(v.uv.x, precision)
-            y = round(v.uv.y, precision)
-
-            for vert in vertsDict[(x,y)]:
-                vert.uv.x = currentX
-                vert.uv.y = currentY
-
-            currentY = currentY - finalScale
-    return
-
-def VertsDictForLine(uv_layer, bm, selVerts, vertsDict):
-    for f in bm.faces:
-        for l in f.loops:
-                luv = l[uv_layer]
-                if luv.select == True:
-                    x = round(luv.uv.x, precision)
-                    y = round(luv.uv.y, precision)
-
-                    vertsDict[(x, y)].append(luv)
-    return
-
-def ScaleTo0OnAxisAndCursor(filteredVerts, vertsDict, startv = None, horizontal = None):
-
+def ScaleTo0OnAxisAndCursor(uv, filteredVerts, uvVerts, uvContext, startv = None, horizontal = None):
+    uvs = uv.tolist()
     verts = filteredVerts
-    verts.sort(key=lambda x: x.uv[0])      #sort by .x
+    verts.sort(key=lambda x: uvs[x][0])      #sort by .x
 
     first = verts[0]
     last = verts[len(verts)-1]
 
     if horizontal == None:
         horizontal = True
-        if ((last.uv.x - first.uv.x) >0.00001):
-            slope = (last.uv.y - first.uv.y)/(last.uv.x - first.uv.x)
+        if ((uvs[last][0] - uvs[first][0]) >0.00001):
+            slope = (uvs[last][1] - uvs[first][1])/(uvs[last][0] - uvs[first][0])
             if (slope > 1) or (slope <-1):
                 horizontal = False
         else:
@@ -611,112 +1152,68 @@ def ScaleTo0OnAxisAndCursor(filteredVerts, vertsDict, startv = None, horizontal
         if startv == None:
             startv = first
 
-        SetAll2dCursorsTo(startv.uv.x, startv.uv.y)
+        SetAll2dCursorsTo(uvContext, *uvs[startv])
         #scale to 0 on Y
-        ScaleTo0('Y')
+        uv[uvVerts.loops, 1] = uv[startv, 1]
         return
 
     else:
-        verts.sort(key=lambda x: x.uv[1])  #sort by .y
+        verts.sort(key=lambda x: uvs[x][1])  #sort by .y
         verts.reverse()     #reverse because y values drop from up to down
         first = verts[0]
         last = verts[len(verts)-1]
         if startv == None:
             startv = first
 
-        SetAll2dCursorsTo(startv.uv.x, startv.uv.y)
+        SetAll2dCursorsTo(uvContext, *uvs[startv])
         #scale to 0 on X
-        ScaleTo0('X')
+        uv[uvVerts.loops, 0] = uv[startv, 0]
         return
 
-def ScaleTo0(axis):
-    last_pivot = bpy.context.space_data.pivot_point
-    bpy.context.space_data.pivot_point = 'CURSOR'
+class UvContext:
+    """Image editors, image size and 2d cursors, resolved once per run
 
-    for area in bpy.context.screen.areas:
-        if area.type == 'IMAGE_EDITOR':
-            if axis == 'Y':
-                bpy.ops.transform.resize(value=(1, 0, 1), constraint_axis=(False, True, False), mirror=False, proportional_edit_falloff='SMOOTH', proportional_size=1)
-            else:
-                bpy.ops.transform.resize(value=(0, 1, 1), constraint_axis=(True, False, False), mirror=False, proportional_edit_falloff='SMOOTH', proportional_size=1)
+    Helpers take this snapshot instead of scanning the screen areas on every call.
+    With texelMip, texel is the uv size of a texel of that mip level of the image,
+    imageSize replaces the size of the image in the editor.
+    """
 
+    def __init__(self, context, texelMip = None, imageSize = None):
+        #there is no screen when running in background
+        self.editors = []
+        if context.screen != None:
+            self.editors = [a for a in context.screen.areas if a.type == 'IMAGE_EDITOR']
 
-    bpy.context.space_data.pivot_point = last_pivot
-    return
-
-
-def hypotVert(v1, v2):
-    hyp = hypot(v1.x - v2.x, v1.y - v2.y)
-    return hyp
-
-def Corners(corners):
-    firstHighest = corners[0]
-    for c in corners:
-        if c.uv.y > firstHighest.uv.y:
-            firstHighest = c
-    corners.remove(firstHighest)
-
-    secondHighest = corners[0]
-    for c in corners:
-        if (c.uv.y > secondHighest.uv.y):
-            secondHighest = c
-
-    if firstHighest.uv.x < secondHighest.uv.x:
-        leftUp = firstHighest
-        rightUp = secondHighest
-    else:
-        leftUp = secondHighest
-        rightUp = firstHighest
-    corners.remove(secondHighest)
-
-    firstLowest = corners[0]
-    secondLowest = corners[1]
-
-    if firstLowest.uv.x < secondLowest.uv.x:
-        leftDown = firstLowest
-        rightDown = secondLowest
-    else:
-        leftDown = secondLowest
-        rightDown = firstLowest
-
-    return leftUp, leftDown, rightUp, rightDown
-
-def ImageSize():
-    ratioX, ratioY = 256,256
-    for a in bpy.context.screen.areas:
-        if a.type == 'IMAGE_EDITOR':
+        self.sizeX, self.sizeY = 256,256
+        for a in self.editors:
             img = a.spaces[0].image
             if img != None and img.size[0] != 0:
-                ratioX, ratioY = img.size[0], img.size[1]
+                self.sizeX, self.sizeY = img.size[0], img.size[1]
             break
-    return ratioX, ratioY
-
-def CursorClosestTo(verts):
-    sizeX, sizeY = ImageSize()
-    if bpy.app.version >= (2, 80, 0):
-        sizeX, sizeY = 1,1
-    min = float('inf')
-    minV = verts[0]
-    for v in verts:
-        if v == None: continue
-        for area in bpy.context.screen.areas:
-            if area.type == 'IMAGE_EDITOR':
-                loc = area.spaces[0].cursor_location
-                hyp = hypot(loc.x/sizeX -v.uv.x, loc.y/sizeY -v.uv.y)
-                if (hyp < min):
-                    min = hyp
-                    minV = v
-    return minV
-
-def SetAll2dCursorsTo(x,y):
-    bpy.ops.uv.cursor_set(location=(x, y))
+        if imageSize != None:
+            self.sizeX, self.sizeY = imageSize
+
+        #cursors are in uv space since 2.80, in pixels before
+        self.cursorScale = (self.sizeX, self.sizeY)
+        if bpy.app.version >= (2, 80, 0):
+            self.cursorScale = (1, 1)
+        scaleX, scaleY = self.cursorScale
+        self.cursors = np.array([(a.spaces[0].cursor_location.x/scaleX, a.spaces[0].cursor_location.y/scaleY)
+            for a in self.editors], dtype=np.float64).reshape(-1, 2)
+
+        self.texel = None
+        if texelMip != None:
+            #a mip level has half the pixels of the previous one, at least one
+            self.texel = np.array((1 / max(self.sizeX >> texelMip, 1), 1 / max(self.sizeY >> texelMip, 1)),
+                dtype=np.float32)
+
+def SetAll2dCursorsTo(uvContext, x, y):
+    scaleX, scaleY = uvContext.cursorScale
+    for a in uvContext.editors:
+        a.spaces[0].cursor_location = (x*scaleX, y*scaleY)
+    uvContext.cursors[:] = (x, y)
     return
 
-def AreVertsQuasiEqual(v1, v2, allowedError = 0.00001):
-    if abs(v1.uv.x -v2.uv.x) < allowedError and abs(v1.uv.y -v2.uv.y) < allowedError:
-        return True
-    return False
-
 def RipUvFaces(context, operator):
     startTime = timer()
 
@@ -727,44 +1224,22 @@ def RipUvFaces(context, operator):
     uv_layer = bm.loops.layers.uv.verify()
     # bm.faces.layers.tex.verify()  # currently blender needs both layers.
 
-    selFaces = []
-
-    for f in bm.faces:
-        isFaceSel = True
-        for l in f.loops:
-            luv = l[uv_layer]
-            if luv.select == False:
-                isFaceSel = False
-                break
-
-        if isFaceSel == True:
-            selFaces.append(f)
-
-    if len(selFaces) == 0:
-        target = None
-        for f in bm.faces:
-            for l in f.loops:
-                luv = l[uv_layer]
-                if luv.select == True:
-                    target = luv
-                    break
-            if target != None: break
-
-        for f in bm.faces:
-            for l in f.loops:
-                luv = l[uv_layer]
-                luv.select = False
-
-        target.select = True
-        return SuccessFinished(me, startTime)
-
-    DeselectAll()
+    buffer = SelectionBuffer(bm, uv_layer)
+    original = buffer.uv.copy(), buffer.select.copy()
+    selFaces = buffer.fullySelected()
+    t = profiler.lap("selection", startTime)
 
-    for sf in selFaces:
-        for l in sf.loops:
-            luv = l[uv_layer]
-            luv.select = True
+    if not selFaces.any():
+        #keep only the first selected vertex
+        target = np.flatnonzero(buffer.select)[:1]
+        buffer.select[:] = False
+        buffer.select[target] = True
+    else:
+        buffer.select = selFaces[buffer.face]
 
+    uvHistory.record(me, buffer, original)
+    buffer.write()
+    profiler.lap("update", t)
     return SuccessFinished(me, startTime)
 
 def JoinUvFaces(context, operator):
@@ -777,134 +1252,376 @@ def JoinUvFaces(context, operator):
     uv_layer = bm.loops.layers.uv.verify()
     # bm.faces.layers.tex.verify()  # currently blender needs both layers.
 
-    vertsDict = defaultdict(list)        #dict
+    t = timer()
+    buffer = SelectionBuffer(bm, uv_layer)
+    original = buffer.uv.copy(), buffer.select.copy()
+    uvs = buffer.uv.tolist()
+    selected = []
 
     #TODO: radius by image scale
     radius = 0.002
+    unselected = UvGridIndex(radius)
 
-    for f in bm.faces:
-        for l in f.loops:
-           luv = l[uv_layer]
-           if luv.select == True:
-               x = round(luv.uv.x, precision)
-               y = round(luv.uv.y, precision)
-               vertsDict[(x,y)].append(luv)
+    for i, select in enumerate(buffer.select.tolist()):
+        if select == True:
+            selected.append(i)
+        else: unselected.insert(uvs[i][0], uvs[i][1], i)
 
-    for key in vertsDict:
-        min = 1
-        minV = None
+    uvVerts = LinkedUvVerts(buffer, selected)
+    t = profiler.lap("selection", t)
+    profiler.count(objects=1, faces=len(buffer.faces), loops=len(buffer.loops))
 
-        for f in bm.faces:
-            for l in f.loops:
-                luv = l[uv_layer]
-                if luv.select == False:
-                    hyp = hypot(vertsDict[(key[0], key[1])][0].uv.x -luv.uv.x, vertsDict[(key[0], key[1])][0].uv.y -luv.uv.y)
-                    if (hyp <= min) and hyp < radius:
-                        min = hyp
-                        minV = luv
-                        minV.select = True
-
-            if min != 1:
-                for v in vertsDict[(key[0], key[1])]:
-                    v = v.uv
-                    v.x = minV.uv.x
-                    v.y = minV.uv.y
+    for verts in uvVerts.groups():
+        x, y = uvs[verts[0]]
+        minV = unselected.closest(x, y, radius)
+        if minV == None: continue
 
-    return SuccessFinished(me, startTime)
+        buffer.select[minV] = True
+        buffer.uv[verts] = buffer.uv[minV]
+    t = profiler.lap("rejoin", t)
 
-def DeselectAll():
-    bpy.ops.uv.select_all(action='DESELECT')
-    return
+    uvHistory.record(me, buffer, original)
+    buffer.write()
+    profiler.lap("update", t)
+    return SuccessFinished(me, startTime)
 
 
 class UV_PT_UvSquares(bpy.types.Operator):
     """Reshapes UV faces to a grid of equivalent squares"""
     bl_idname = "uv.uv_squares"
     bl_label = "UVs to grid of squares"
-    bl_options = {'REGISTER', 'UNDO'}
+    bl_options = {'REGISTER'}
     @classmethod
     def poll(cls, context):
         return (context.mode == 'EDIT_MESH')
 
     def execute(self, context):
+        profiler.start(context.scene.uv_squares.trace_memory)
         main(context, self, True)
-        return {'FINISHED'}
+        return FinishRun(self, context)
 
 class UV_PT_UvSquaresByShape(bpy.types.Operator):
     """Reshapes UV faces to a grid with respect to shape by length of edges around selected corner"""
     bl_idname = "uv.uv_squares_by_shape"
     bl_label = "UVs to grid with respect to shape"
-    bl_options = {'REGISTER', 'UNDO'}
+    bl_options = {'REGISTER'}
 
     @classmethod
     def poll(cls, context):
         return (context.mode == 'EDIT_MESH')
 
     def execute(self, context):
+        profiler.start(context.scene.uv_squares.trace_memory)
         main(context, self)
-        return {'FINISHED'}
+        return FinishRun(self, context)
+
+class UV_PT_UvSquaresModal(bpy.types.Operator):
+    """Reshapes UV faces to a grid with a live preview, S toggles squares and shape, C the start corner, moving the mouse the aspect"""
+    bl_idname = "uv.uv_squares_modal"
+    bl_label = "UVs to grid interactively"
+    bl_options = {'REGISTER'}
+
+    @classmethod
+    def poll(cls, context):
+        return (context.mode == 'EDIT_MESH')
+
+    def invoke(self, context, event):
+        if context.scene.tool_settings.use_uv_select_sync:
+            self.report({'ERROR'}, "Please disable 'Keep UV and edit mesh in sync'")
+            return {'CANCELLED'}
+
+        settings = context.scene.uv_squares
+        self.uvContext = UvContext(context, settings.texel_mip if settings.texel_snap else None)
+        #both modes walk their own rows, so both are found while the uvs are still original
+        self.jobs = {square: self.gridJobs(context, square) for square in (True, False)}
+        self.square = True
+        self.corner = 0
+        self.aspect = 1.0
+        self.startX = event.mouse_x
+        if len(self.jobs[self.square]) == 0:
+            self.report({'WARNING'}, "Select UV quads to reshape")
+            return {'CANCELLED'}
+
+        self.preview(context)
+        #mouse moves only set the aspect, the timer shows the last one
+        self.moved = False
+        self.timer = context.window_manager.event_timer_add(1 / 60, window=context.window)
+        context.window_manager.modal_handler_add(self)
+        return {'RUNNING_MODAL'}
+
+    def gridJobs(self, context, square):
+        """Jobs with the islands, rows and original uvs of the selected meshes"""
+        objects = list(context.selected_objects)
+        if (context.edit_object not in objects):
+            objects.append(context.edit_object)
+
+        settings = context.scene.uv_squares
+        relax = settings.relax_iterations if settings.relax_non_quads else 0
+        jobs = []
+        meshes = set()
+        for obj in objects:
+            if (obj.type == "MESH") and obj.data.as_pointer() not in meshes:
+                meshes.add(obj.data.as_pointer())
+                #snapToClosest leaves lines alone, only grids are previewed
+                job = SquareBmesh(obj.data, bmesh.from_edit_mesh(obj.data), self.uvContext, square, True, timer(),
+                    relax = relax)
+                if job == None: continue
+                job.shown = job.original[0].copy(), job.original[1].copy()
+                #original uvs with the non quads already deselected, each preview starts from them
+                job.start = job.original[0].copy(), job.buffer.select.copy()
+                job.baseRatio, job.baseShapes = job.ratio, job.shapes
+                jobs.append(job)
+        return jobs
+
+    def show(self, job, uv, select):
+        """Writes the loops that differ from what is shown"""
+        shownUv, shownSelect = job.shown
+        changed = np.flatnonzero((uv != shownUv).any(axis=1) | (select != shownSelect))
+        job.buffer.uv[:], job.buffer.select[:] = uv, select
+        job.buffer.write(changed)
+        job.shown = uv.copy(), select.copy()
+        meshUpdates.add(job.me)
+
+    def preview(self, context):
+        t = timer()
+        settings = context.scene.uv_squares
+        jobs = self.jobs[self.square]
+        for job in jobs:
+            job.buffer.uv[:], job.buffer.select[:] = job.start
+            job.square = self.square
+            job.ratio = job.baseRatio * self.aspect
+            job.shapes = [self.startCorner(shape) for shape in job.baseShapes]
+        #solved in Blender, starting the workers takes longer than a preview
+        SolveJobs(jobs, settings, parallel = False)
+        for job in jobs:
+            self.show(job, job.buffer.uv, job.buffer.select)
+        self.moved = False
+        meshUpdates.flush(settings.uv_only_update)
+
+        corner = "Cursor" if self.corner == 0 else "Cursor + %d" % self.corner
+        context.area.header_text_set("UV Squares: %s (S), start corner: %s (C), aspect: %.2f (mouse, R resets), %.1f ms" %
+            ("Squares" if self.square else "Shape", corner, self.aspect, (timer() - t) * 1000))
+
+    def startCorner(self, shape):
+        """shape with its start corner moved self.corner corners clockwise from the closest one to the cursor"""
+        if shape == None or self.corner == 0: return shape
+        corners = list(shape[:4])
+        start = corners.index(shape[4]) if shape[4] in corners else 0
+        return (*corners, corners[(start + self.corner) % 4])
+
+    def finish(self, context, result):
+        context.window_manager.event_timer_remove(self.timer)
+        context.area.header_text_set(None)
+        return result
+
+    def modal(self, context, event):
+        if event.type == 'MOUSEMOVE':
+            if self.square:
+                self.aspect = 2 ** ((event.mouse_x - self.startX) / 200)
+                self.moved = True
+        elif event.type == 'TIMER':
+            if self.moved: self.preview(context)
+        elif event.value != 'PRESS':
+            return {'RUNNING_MODAL'}
+        elif event.type == 'S':
+            #the jobs of the other mode expect the original uvs to be shown
+            for job in self.jobs[self.square]:
+                self.show(job, *job.original)
+            self.square = not self.square
+            self.preview(context)
+        elif event.type == 'C':
+            self.corner = (self.corner + 1) % 4
+            self.preview(context)
+        elif event.type == 'R':
+            self.aspect = 1.0
+            self.startX = event.mouse_x
+            self.preview(context)
+        elif event.type in {'LEFTMOUSE', 'RET', 'NUMPAD_ENTER'}:
+            settings = context.scene.uv_squares
+            if self.moved: self.preview(context)
+            for job in self.jobs[self.square]:
+                uvHistory.record(job.me, job.buffer, job.original)
+            uvHistory.commit(settings.history_steps, settings.history_mb)
+            UndoPush(self, context)
+            return self.finish(context, {'FINISHED'})
+        elif event.type in {'RIGHTMOUSE', 'ESC'}:
+            for job in self.jobs[self.square]:
+                self.show(job, *job.original)
+            meshUpdates.flush(context.scene.uv_squares.uv_only_update)
+            return self.finish(context, {'CANCELLED'})
+        return {'RUNNING_MODAL'}
+
+class UV_PT_RevertLast(bpy.types.Operator):
+    """Restore the UVs changed by the last UV Squares operation, without going through the undo history"""
+    bl_idname = "uv.uv_squares_revert"
+    bl_label = "Revert last UV Squares"
+    bl_options = {'REGISTER'}
+
+    @classmethod
+    def poll(cls, context):
+        return (context.mode == 'EDIT_MESH') and len(uvHistory.steps) > 0
+
+    def execute(self, context):
+        profiler.start(context.scene.uv_squares.trace_memory)
+        skipped = uvHistory.revert()
+        if skipped > 0:
+            self.report({'WARNING'}, "%d meshes left edit mode or changed since, their UVs were not reverted" % skipped)
+        #with undo steps on, undo would otherwise bring the reverted uvs back
+        return FinishRun(self, context)
 
 class UV_PT_RipFaces(bpy.types.Operator):
     """Rip UV faces apart"""
     bl_idname = "uv.uv_face_rip"
     bl_label = "UV face rip"
-    bl_options = {'REGISTER', 'UNDO'}
+    bl_options = {'REGISTER'}
 
     @classmethod
     def poll(cls, context):
         return (context.mode == 'EDIT_MESH')
 
     def execute(self, context):
+        profiler.start(context.scene.uv_squares.trace_memory)
         RipUvFaces(context, self)
-        return {'FINISHED'}
+        return FinishRun(self, context)
 
 class UV_PT_JoinFaces(bpy.types.Operator):
     """Join selection to closest nonselected vertices (has to be very close)"""
     bl_idname = "uv.uv_face_join"
     bl_label = "UV selection join to closest unselected"
-    bl_options = {'REGISTER', 'UNDO'}
+    bl_options = {'REGISTER'}
 
     @classmethod
     def poll(cls, context):
         return (context.mode == 'EDIT_MESH')
 
     def execute(self, context):
+        profiler.start(context.scene.uv_squares.trace_memory)
         JoinUvFaces(context, self)
-        return {'FINISHED'}
+        return FinishRun(self, context)
 
 class UV_PT_SnapToAxis(bpy.types.Operator):
     """Snap sequenced vertices to Axis"""
     bl_idname = "uv.uv_snap_to_axis"
     bl_label = "UV snap vertices to axis"
-    bl_options = {'REGISTER', 'UNDO'}
+    bl_options = {'REGISTER'}
 
     @classmethod
     def poll(cls, context):
         return (context.mode == 'EDIT_MESH')
 
     def execute(self, context):
+        profiler.start(context.scene.uv_squares.trace_memory)
         main(context, self)
-        return {'FINISHED'}
+        return FinishRun(self, context)
 
 class UV_PT_SnapToAxisWithEqual(bpy.types.Operator):
     """Snap sequenced vertices to Axis with Equal Distance between"""
     bl_idname = "uv.uv_snap_to_axis_and_equal"
     bl_label = "UV snap vertices to axis with equal distance between"
-    bl_options = {'REGISTER', 'UNDO'}
+    bl_options = {'REGISTER'}
 
     @classmethod
     def poll(cls, context):
         return (context.mode == 'EDIT_MESH')
 
     def execute(self, context):
+        profiler.start(context.scene.uv_squares.trace_memory)
         main(context, self)
         main(context, self)
-        return {'FINISHED'}
+        return FinishRun(self, context)
+
+class UvSquaresSettings(bpy.types.PropertyGroup):
+    use_parallel: bpy.props.BoolProperty(
+        name="Parallel",
+        description="Square the UVs of multiple selected objects and islands in worker processes",
+        default=False)
+    threads: bpy.props.IntProperty(
+        name="Workers",
+        description="Number of worker processes, 0 uses one per core",
+        default=0, min=0)
+    uv_only_update: bpy.props.BoolProperty(
+        name="UV Only Update",
+        description="Skip recalculating triangulation and normals when updating the edited meshes, only UVs change",
+        default=True)
+    profile: bpy.props.BoolProperty(
+        name="Profile",
+        description="Report the time of every phase of a run, with face, loop and island counts",
+        default=False)
+    profile_log: bpy.props.StringProperty(
+        name="Log File",
+        description="Append the profile of every run to this file as a line of JSON",
+        default="", subtype='FILE_PATH')
+    trace_memory: bpy.props.BoolProperty(
+        name="Trace Memory",
+        description="Add the peak memory of Python and NumPy allocations to the profile, makes runs slower",
+        default=False)
+    low_memory: bpy.props.BoolProperty(
+        name="Low Memory",
+        description="Square islands in chunks that are read and written back one at a time, for very large meshes",
+        default=False)
+    chunk_faces: bpy.props.IntProperty(
+        name="Chunk Faces",
+        description="Faces per chunk in low memory mode, whole islands are kept together so chunks can be larger",
+        default=100000, min=1)
+    relax_non_quads: bpy.props.BoolProperty(
+        name="Relax Non-Quads",
+        description="Keep triangles and n-gons in the selection and relax their inner UVs between the squared quads, instead of deselecting them",
+        default=False)
+    relax_iterations: bpy.props.IntProperty(
+        name="Iterations",
+        description="Relaxing steps for the UVs of non-quads, more spread them out more evenly",
+        default=50, min=1)
+    uv_maps: bpy.props.StringProperty(
+        name="Also on UV Maps",
+        description="Square the same quads on these UV maps too, comma separated names or patterns like Lightmap*, islands and rows are found once on the active one",
+        default="")
+    texel_snap: bpy.props.BoolProperty(
+        name="Snap to Texels",
+        description="Put every grid line on a texel boundary of the image in the UV editor",
+        default=False)
+    texel_mip: bpy.props.IntProperty(
+        name="Mip Level",
+        description="Snap to the texels of this mip level, each level doubles the texel size",
+        default=0, min=0, max=16)
+    history_steps: bpy.props.IntProperty(
+        name="Revert Steps",
+        description="Number of UV Squares operations that can be reverted, only the changed UVs are kept",
+        default=16, min=0)
+    history_mb: bpy.props.FloatProperty(
+        name="Revert Memory",
+        description="Memory in MB for the reverting steps, the oldest are dropped first",
+        default=256.0, min=0.0)
+    undo_push: bpy.props.BoolProperty(
+        name="Undo Steps",
+        description="Also push a step to the undo history after each operation, it copies the whole mesh. Revert Last works without it",
+        default=True)
 
 addon_keymaps = []
 
+@bpy.app.handlers.persistent
+def InvalidateIslandCache(scene, depsgraph):
+    meshes = set()
+    for update in depsgraph.updates:
+        if update.is_updated_geometry:
+            id = update.id.original
+            if isinstance(id, bpy.types.Object): id = id.data
+            if isinstance(id, bpy.types.Mesh): meshes.add(id.as_pointer())
+
+    for mesh in meshes:
+        islandCache.invalidate(mesh)
+
+@bpy.app.handlers.persistent
+def ClearIslandCache(*args):
+    islandCache.clear()
+
+@bpy.app.handlers.persistent
+def ClearUvHistory(*args):
+    #after undo the kept uvs could be older than the mesh
+    uvHistory.clear()
+
 def menu_func_uv_squares(self, context): self.layout.operator(UV_PT_UvSquares.bl_idname)
 def menu_func_uv_squares_by_shape(self, context): self.layout.operator(UV_PT_UvSquaresByShape.bl_idname)
+def menu_func_uv_squares_modal(self, context): self.layout.operator(UV_PT_UvSquaresModal.bl_idname)
 def menu_func_face_join(self, context): self.layout.operator(UV_PT_JoinFaces.bl_idname)
 
 class UV_PT_UvSquaresPanel(bpy.types.Panel):
@@ -916,6 +1633,7 @@ class UV_PT_UvSquaresPanel(bpy.types.Panel):
 
     def draw(self, context):
         layout = self.layout
+        settings = context.scene.uv_squares
 
         row = layout.row()
         row.label(text="Select Sequenced Vertices to:")
@@ -930,6 +1648,16 @@ class UV_PT_UvSquaresPanel(bpy.types.Panel):
         col = split.column(align=True)
         col.operator(UV_PT_UvSquaresByShape.bl_idname, text="To Grid By Shape", icon = "UV_FACESEL")
         col.operator(UV_PT_UvSquares.bl_idname, text="To Square Grid", icon = "GRID")
+        col.operator(UV_PT_UvSquaresModal.bl_idname, text="To Grid Interactively", icon = "RESTRICT_SELECT_OFF")
+        col.prop(settings, "relax_non_quads")
+        row = col.row(align=True)
+        row.active = settings.relax_non_quads
+        row.prop(settings, "relax_iterations")
+        col.prop(settings, "uv_maps")
+        col.prop(settings, "texel_snap")
+        row = col.row(align=True)
+        row.active = settings.texel_snap
+        row.prop(settings, "texel_mip")
 
         split = layout.split()
         col = split.column(align=True)
@@ -943,21 +1671,64 @@ class UV_PT_UvSquaresPanel(bpy.types.Panel):
         row = col.row(align=True)
 
         col.operator(UV_PT_JoinFaces.bl_idname, text="Snap to Closest Unselected", icon = "SNAP_GRID")
+        col.operator(UV_PT_RevertLast.bl_idname, text="Revert Last (%d, %.1f MB)" % (len(uvHistory.steps), uvHistory.bytes / 2**20), icon = "LOOP_BACK")
         row = layout.row()
 
+        row = layout.row()
+        row.label(text="Performance:")
+        split = layout.split()
+        col = split.column(align=True)
+        col.prop(settings, "use_parallel")
+        row = col.row(align=True)
+        row.active = settings.use_parallel
+        row.prop(settings, "threads")
+        col.prop(settings, "uv_only_update")
+        col.prop(settings, "low_memory")
+        row = col.row(align=True)
+        row.active = settings.low_memory
+        row.prop(settings, "chunk_faces")
+        col.prop(settings, "history_steps")
+        col.prop(settings, "history_mb")
+        col.prop(settings, "undo_push")
+        col.prop(settings, "profile")
+        if settings.profile:
+            col.prop(settings, "profile_log")
+            col.prop(settings, "trace_memory")
+            last = profiler.last
+            if last != None:
+                box = layout.box()
+                col = box.column(align=True)
+                col.label(text="Last run: %.1f ms" % (last["total"] * 1000))
+                for phase, seconds in last["phases"].items():
+                    col.label(text="%s: %.1f ms" % (phase.capitalize(), seconds * 1000))
+                col.label(text="%(objects)d objects, %(faces)d faces, %(loops)d loops, %(islands)d islands" % last["counts"])
+                if "peak_mb" in last:
+                    col.label(text="Peak memory: %.1f MB" % last["peak_mb"])
+
 def register():
+    bpy.utils.register_class(UvSquaresSettings)
+    bpy.types.Scene.uv_squares = bpy.props.PointerProperty(type=UvSquaresSettings)
+
     bpy.utils.register_class(UV_PT_UvSquaresPanel)
     bpy.utils.register_class(UV_PT_UvSquares)
     bpy.utils.register_class(UV_PT_UvSquaresByShape)
+    bpy.utils.register_class(UV_PT_UvSquaresModal)
     bpy.utils.register_class(UV_PT_JoinFaces)
+    bpy.utils.register_class(UV_PT_RevertLast)
     bpy.utils.register_class(UV_PT_SnapToAxis)
     bpy.utils.register_class(UV_PT_SnapToAxisWithEqual)
 
     #menu
     bpy.types.IMAGE_MT_uvs.append(menu_func_uv_squares)
     bpy.types.IMAGE_MT_uvs.append(menu_func_uv_squares_by_shape)
+    bpy.types.IMAGE_MT_uvs.append(menu_func_uv_squares_modal)
     bpy.types.IMAGE_MT_uvs.append(menu_func_face_join)
 
+    bpy.app.handlers.depsgraph_update_post.append(InvalidateIslandCache)
+    bpy.app.handlers.load_post.append(ClearIslandCache)
+    for handlers in (bpy.app.handlers.load_post, bpy.app.handlers.undo_post, bpy.app.handlers.redo_post):
+        handlers.append(ClearUvHistory)
+
     #handle the keymap
     wm = bpy.context.window_manager
 
@@ -974,19 +1745,144 @@ def unregister():
     bpy.utils.unregister_class(UV_PT_UvSquaresPanel)
     bpy.utils.unregister_class(UV_PT_UvSquares)
     bpy.utils.unregister_class(UV_PT_UvSquaresByShape)
+    bpy.utils.unregister_class(UV_PT_UvSquaresModal)
     bpy.utils.unregister_class(UV_PT_JoinFaces)
+    bpy.utils.unregister_class(UV_PT_RevertLast)
     bpy.utils.unregister_class(UV_PT_SnapToAxis)
     bpy.utils.unregister_class(UV_PT_SnapToAxisWithEqual)
 
+    del bpy.types.Scene.uv_squares
+    bpy.utils.unregister_class(UvSquaresSettings)
+
     bpy.types.IMAGE_MT_uvs.remove(menu_func_uv_squares)
     bpy.types.IMAGE_MT_uvs.remove(menu_func_uv_squares_by_shape)
+    bpy.types.IMAGE_MT_uvs.remove(menu_func_uv_squares_modal)
     bpy.types.IMAGE_MT_uvs.remove(menu_func_face_join)
 
+    bpy.app.handlers.depsgraph_update_post.remove(InvalidateIslandCache)
+    bpy.app.handlers.load_post.remove(ClearIslandCache)
+    for handlers in (bpy.app.handlers.load_post, bpy.app.handlers.undo_post, bpy.app.handlers.redo_post):
+        handlers.remove(ClearUvHistory)
+    islandCache.clear()
+    uvHistory.clear()
+    workerPool.shutdown()
+
     # handle the keymap
     for km, kmi in addon_keymaps:
         km.keymap_items.remove(kmi)
     # clear the list
     addon_keymaps.clear()
 
+def BatchSquare(argv):
+    """Squares the UVs of meshes in .blend files, without any UI
+
+    blender -b -P uv_squares.py -- [--mode square|shape] [--objects PATTERN]
+        [--materials PATTERN] [--uv-maps PATTERNS] [--image-size WxH] [--texel-mip LEVEL]
+        [--report report.json] [--dry-run] file.blend ...
+    """
+    parser = argparse.ArgumentParser(prog="blender -b -P uv_squares.py --",
+        description="Reshape the UV quads of meshes in .blend files to a grid.")
+    parser.add_argument("files", nargs="+", help=".blend files to process")
+    parser.add_argument("--mode", choices=("square", "shape"), default="square",
+        help="grid of equal squares or grid by shape of a quad (default: square)")
+    parser.add_argument("--objects", default="*", help="only objects with a matching name (default: *)")
+    parser.add_argument("--materials", default="*", help="only faces with a matching material name (default: *)")
+    parser.add_argument("--uv-maps", default="",
+        help="also square the quads on the UV maps matching these comma separated patterns (default: active only)")
+    parser.add_argument("--image-size", type=lambda size: tuple(int(n) for n in size.lower().split("x")),
+        help="WIDTHxHEIGHT of the texture for the square ratio and texel snapping (default: 256x256)")
+    parser.add_argument("--texel-mip", type=int,
+        help="snap the grid lines to texels of this mip level of the texture")
+    parser.add_argument("--report", help="write the per file timing report as JSON to this path")
+    parser.add_argument("--dry-run", action="store_true", help="do not save the files")
+    args = parser.parse_args(argv)
+
+    report = []
+    for path in args.files:
+        startTime = timer()
+        bpy.ops.wm.open_mainfile(filepath=path)
+        islandCache.clear()
+        profiler.start()
+        loadTime = timer()
+        uvContext = UvContext(bpy.context, args.texel_mip, args.image_size)
+
+        stats = {"file": path, "objects": 0, "islands": 0, "faces": 0, "loops": 0}
+        meshes = set()
+        for obj in bpy.data.objects:
+            if (obj.type != "MESH" or obj.data.library != None or
+                obj.data.as_pointer() in meshes or
+                not fnmatchcase(obj.name, args.objects)):
+                    continue
+            meshes.add(obj.data.as_pointer())
+
+            job = BatchSquareMesh(obj, uvContext, args.materials, args.mode == "square", args.uv_maps)
+            if job == None: continue
+            stats["objects"] += 1
+            stats["islands"] += len(job.islands)
+            stats["faces"] += len(job.buffer.faces)
+            stats["loops"] += len(job.buffer.loops)
+
+        squareTime = timer()
+        if not args.dry_run and stats["objects"] > 0:
+            bpy.ops.wm.save_mainfile()
+
+        stats["load_s"] = round(loadTime - startTime, 3)
+        stats["square_s"] = round(squareTime - loadTime, 3)
+        stats["save_s"] = round(timer() - squareTime, 3)
+        stats["faces_per_s"] = round(stats["faces"] / max(stats["square_s"], 0.001))
+        stats["phases_s"] = {phase: round(seconds, 3) for phase, seconds in profiler.stop()["phases"].items()}
+        report.append(stats)
+        print("UvSquares: %s, %d objects, %d faces in %.2f s (%d faces/s)" % (
+            path, stats["objects"], stats["faces"], stats["square_s"], stats["faces_per_s"]))
+
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+    return report
+
+def BatchSquareMesh(obj, uvContext, materials, square, uvMaps = ""):
+    """Squares all quads of obj that use a material matching materials, leaves selection as it was
+
+    The quads are squared on the active uv layer and on the uv layers matching uvMaps.
+    """
+    me = obj.data
+    if len(me.uv_layers) == 0: return None
+
+    slots = [fnmatchcase(s.material.name if s.material != None else "", materials) for s in obj.material_slots]
+    bm = bmesh.new()
+    bm.from_mesh(me)
+    uv_layer = bm.loops.layers.uv.verify()
+    layers = UvLayersMatching(bm, uvMaps)
+
+    #the mesh selection is left alone, only the uv selection is set on the faces given
+    faces = [f for f in bm.faces
+        if (slots[f.material_index] if f.material_index < len(slots) else materials == "*")]
+    uvSelect = [[l[layer].select for f in bm.faces for l in f.loops] for layer in [uv_layer] + layers]
+    for f in faces:
+        for l in f.loops:
+            l[uv_layer].select = True
+
+    #without quads the whole selection would be aligned to a line
+    job = None
+    if any(len(f.loops) == 4 for f in faces):
+        profiler.count(objects=1)
+        job = SquareBmesh(me, bm, uvContext, square, False, timer(), faces = faces, layers = layers)
+        for j in [job] + job.layerJobs:
+            j.solve()
+            j.buffer.write()
+
+    for layer, layerSelect in zip([uv_layer] + layers, uvSelect):
+        for l, select in zip((l for f in bm.faces for l in f.loops), layerSelect):
+            l[layer].select = select
+
+    if job != None:
+        bm.to_mesh(me)
+        me.update()
+    bm.free()
+    return job
+
 if __name__ == "__main__":
-    register()
+    if "--" in sys.argv:
+        BatchSquare(sys.argv[sys.argv.index("--") + 1:])
+    else:
+        register()
@@ -0,0 +1,451 @@
+#    <Uv Squares, Blender addon for reshaping UV vertices to grid.>
+#    Copyright (C) <2020> <Reslav Hollos>
+#    This program is free software: you can redistribute it and/or modify
+#    it under the terms of the GNU General Public License as published by
+#    the Free Software Foundation, either version 3 of the License, or
+#    (at your option) any later version.
+#
+#    This program is distributed in the hope that it will be useful,
+#    but WITHOUT ANY WARRANTY; without even the implied warranty of
+#    MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+#    GNU General Public License for more details.
+#
+#    You should have received a copy of the GNU General Public License
+#    along with this program. If not, see <http://www.gnu.org/licenses/>.
+
+"""Array core of UV Squares
+
+Works on plain numpy arrays of loop uvs and loop indices, nothing here imports
+bpy or bmesh, so it can be profiled and checked outside of Blender. The addon
+reads the selection into these arrays and writes the results back.
+"""
+
+import numpy as np
+from collections import defaultdict
+from math import hypot, floor, ceil
+from timeit import default_timer as timer
+
+precision = 3
+
+def MakeUvFaceEqualRectangle(uv, uvVerts, lucv, rucv, rdcv, ldcv, startv, square = False, ratio = 1, texel = None):
+
+    groups = [uvVerts.members(v) for v in (lucv, rucv, rdcv, ldcv)]
+    if startv != None: startv = uv[startv].tolist()
+    lucv = uv[lucv].tolist()
+    rucv = uv[rucv].tolist()
+    rdcv = uv[rdcv].tolist()
+    ldcv = uv[ldcv].tolist()
+
+    if startv == None: startv = lucv
+    elif AreVertsQuasiEqual(startv, rucv): startv = rucv
+    elif AreVertsQuasiEqual(startv, rdcv): startv = rdcv
+    elif AreVertsQuasiEqual(startv, ldcv): startv = ldcv
+    else: startv = lucv
+
+    if (startv == lucv):
+        finalScaleX = hypotVert(lucv, rucv)
+        finalScaleY = hypotVert(lucv, ldcv)
+        currRowX = lucv[0]
+        currRowY = lucv[1]
+
+    elif (startv == rucv):
+        finalScaleX = hypotVert(rucv, lucv)
+        finalScaleY = hypotVert(rucv, rdcv)
+        currRowX = rucv[0] - finalScaleX
+        currRowY = rucv[1]
+
+    elif (startv == rdcv):
+        finalScaleX = hypotVert(rdcv, ldcv)
+        finalScaleY = hypotVert(rdcv, rucv)
+        currRowX = rdcv[0] - finalScaleX
+        currRowY = rdcv[1] + finalScaleY
+
+    else:
+        finalScaleX = hypotVert(ldcv, rdcv)
+        finalScaleY = hypotVert(ldcv, lucv)
+        currRowX = ldcv[0]
+        currRowY = ldcv[1] +finalScaleY
+
+    if square: finalScaleY = finalScaleX*ratio
+    if texel is not None:
+        #whole texels for the size and start of the grid
+        texelX, texelY = texel.tolist()
+        finalScaleX = max(round(finalScaleX / texelX), 1) * texelX
+        finalScaleY = max(round(finalScaleY / texelY), 1) * texelY
+        currRowX = round(currRowX / texelX) * texelX
+        currRowY = round(currRowY / texelY) * texelY
+    #lucv, rucv
+    uv[groups[0]] = (currRowX, currRowY)
+    uv[groups[1]] = (currRowX + finalScaleX, currRowY)
+
+    #rdcv, ldcv
+    uv[groups[2]] = (currRowX + finalScaleX, currRowY - finalScaleY)
+    uv[groups[3]] = (currRowX, currRowY - finalScaleY)
+
+    return
+
+def SquareIslands(uv, islands, square, ratio, texel = None):
+    """Squares islands on uv in place, returns uv and the seconds spent shaping and propagating
+
+    islands are (shape, groups, steps) per island: the corner loops for
+    MakeUvFaceEqualRectangle (None without a target quad), the loops of the uv vertex
+    of each corner and the steps of PropagateRows. Only plain arrays go in and out,
+    so this also runs in worker processes.
+    """
+    shaping = propagation = 0.0
+    for shape, groups, steps in islands:
+        t = timer()
+        if shape != None:
+            MakeUvFaceEqualRectangle(uv, CornerGroups(groups), *shape, square, ratio, texel)
+        t2 = timer()
+        PropagateRows(uv, *steps)
+        shaping += t2 - t
+        propagation += timer() - t2
+    return uv, shaping, propagation
+
+class CornerGroups:
+    """members() of the corner loops of SquareIslands, in place of the whole UvVerts"""
+
+    def __init__(self, groups):
+        self.groups = groups
+
+    def members(self, i):
+        return self.groups[i]
+
+def IslandsOnOwnLoops(islands):
+    """Loops used by islands of SquareIslands and the islands with indices into those loops
+
+    Squaring uv[loops] with the returned islands gives the same values as squaring
+    uv with the given ones, only the uvs of the islands have to go to a worker.
+    """
+    used = [np.zeros(0, dtype=np.int32)]
+    for shape, groups, steps in islands:
+        used.append(steps[0].ravel())
+        used.extend(groups.values())
+    loops = np.unique(np.concatenate(used))
+
+    def local(a):
+        return np.searchsorted(loops, a).astype(np.int32)
+
+    remapped = []
+    for shape, groups, steps in islands:
+        if shape != None:
+            shape = tuple(int(i) for i in local(np.array(shape)))
+        groups = {int(local(c)): local(members) for c, members in groups.items()}
+        remapped.append((shape, groups, (local(steps[0]),) + tuple(steps[1:])))
+    return loops, remapped
+
+def Corners(uv, corners):
+    uvs = {c: uv[c].tolist() for c in corners}
+    firstHighest = corners[0]
+    for c in corners:
+        if uvs[c][1] > uvs[firstHighest][1]:
+            firstHighest = c
+    corners.remove(firstHighest)
+
+    secondHighest = corners[0]
+    for c in corners:
+        if (uvs[c][1] > uvs[secondHighest][1]):
+            secondHighest = c
+
+    if uvs[firstHighest][0] < uvs[secondHighest][0]:
+        leftUp = firstHighest
+        rightUp = secondHighest
+    else:
+        leftUp = secondHighest
+        rightUp = firstHighest
+    corners.remove(secondHighest)
+
+    firstLowest = corners[0]
+    secondLowest = corners[1]
+
+    if uvs[firstLowest][0] < uvs[secondLowest][0]:
+        leftDown = firstLowest
+        rightDown = secondLowest
+    else:
+        leftDown = secondLowest
+        rightDown = firstLowest
+
+    return leftUp, leftDown, rightUp, rightDown
+
+def PropagateRows(uv, steps, facs, rows):
+    """Extrapolates uvs along the steps of FollowActiveSteps, one row of faces at a time
+
+    Faces of a row only read uvs of the previous row, so each row is a handful of
+    array operations in the same float32 arithmetic as the per face mathutils version.
+    """
+    for start, end in zip(rows[:-1], rows[1:]):
+        l_a = steps[start:end, :4]
+        l_b = steps[start:end, 4:]
+        fac = facs[start:end, None]
+
+        for inner, outer in ((0, 3), (1, 2)):
+            l_a_inner = uv[l_a[:, inner]]
+            uv[l_b[:, inner]] = l_a_inner
+            uv[l_b[:, outer]] = l_a_inner + ((l_a_inner - uv[l_a[:, outer]]) * fac)
+
+def SnapToTexels(uv, loops, texel):
+    """Rounds the uvs of loops to the closest corner of texels of size texel"""
+    uv[loops] = np.round(uv[loops] / texel) * texel
+
+def ClosestTo(uv, verts, points):
+    """Loop of verts whose uv is closest to any of points, verts[0] if there are no points"""
+    candidates = [v for v in verts if v != None]
+    if len(points) == 0 or len(candidates) == 0: return verts[0]
+
+    coords = uv[candidates].astype(np.float64)
+    dist = np.hypot(points[:, None, 0] - coords[None, :, 0], points[:, None, 1] - coords[None, :, 1])
+    return candidates[int(dist.min(axis=0).argmin())]
+
+def AreVectsLinedOnAxis(uv, verts):
+    areLinedX = True
+    areLinedY = True
+    allowedError = 0.00001
+    valX, valY = uv[verts[0]].tolist()
+    for x, y in uv[verts].tolist():
+        if abs(valX - x) > allowedError:
+            areLinedX = False
+        if abs(valY - y) > allowedError:
+            areLinedY = False
+    return areLinedX or areLinedY
+
+def MakeEqualDistanceBetweenVertsInLine(uv, filteredVerts, uvVerts, startv = None):
+    uvs = uv.tolist()
+    verts = filteredVerts
+    verts.sort(key=lambda x: uvs[x][0])      #sort by .x
+
+    first = uvs[verts[0]]
+    last = uvs[verts[len(verts)-1]]
+
+    horizontal = True
+    if ((last[0] - first[0]) >0.00001):
+        slope = (last[1] - first[1])/(last[0] - first[0])
+        if (slope > 1) or (slope <-1):
+            horizontal = False
+    else:
+        horizontal = False
+
+    if horizontal == True:
+        length = hypot(first[0] - last[0], first[1] - last[1])
+
+        currentX = first[0]
+        currentY = first[1]
+    else:
+        verts.sort(key=lambda x: uvs[x][1])  #sort by .y
+        verts.reverse()     #reverse because y values drop from up to down
+        first = uvs[verts[0]]
+        last = uvs[verts[len(verts)-1]]
+
+        length = hypot(first[0] - last[0], first[1] - last[1])  # we have to call length here because if it is not Hor first and second can not actually be first and second
+
+        currentX = first[0]
+        currentY = first[1]
+
+    numberOfVerts = len(verts)
+    finalScale = length / (numberOfVerts-1)
+
+    if horizontal == True:
+        for v in verts:
+            uv[uvVerts.members(v)] = (currentX, currentY)
+            currentX = currentX + finalScale
+    else:
+        for v in verts:
+            uv[uvVerts.members(v)] = (currentX, currentY)
+            currentY = currentY - finalScale
+    return
+
+def JoinCoincident(uv, verts, uvVerts, allowedError = 0.00001):
+    """Joins verts sitting on the same spot in uvVerts, returns the first vert of every spot
+
+    Spots are found with a grid hash of allowedError sized cells, so a vert is only
+    compared to the few already found in the neighbouring cells.
+    """
+    uvs = uv.tolist()
+    found = []
+    spots = UvGridIndex(allowedError)
+    for v in verts:
+        x, y = uvs[v]
+        #the first one found wins, as with a scan over found
+        same = [i for ix, iy, i in spots.near(x, y, allowedError)
+            if AreVertsQuasiEqual((ix, iy), (x, y), allowedError)]
+        if len(same) == 0:
+            spots.insert(x, y, len(found))
+            found.append(v)
+        else: uvVerts.join(found[min(same)], v)
+    return found
+
+class UvVerts:
+    """Union-find over count loops, grouping the given loops into uv vertices
+
+    Callers join() the loops that are the same uv vertex. Once grouped, ids holds the
+    uv vertex of every loop (-1 for loops that were not grouped) and members() the
+    loops of a uv vertex.
+    """
+
+    def __init__(self, count, loops):
+        self.loops = loops
+        self.parent = list(range(count))
+        self.ids = None
+
+    def find(self, i):
+        parent = self.parent
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def join(self, i, j):
+        i = self.find(i)
+        j = self.find(j)
+        if i != j:
+            self.parent[max(i, j)] = min(i, j)
+
+    def group(self):
+        loops = np.array(self.loops, dtype=np.int32)
+        roots = np.array([self.find(i) for i in self.loops], dtype=np.int32)
+        labels, ids = np.unique(roots, return_inverse=True)
+        order = np.argsort(ids, kind='stable')
+
+        self.ids = np.full(len(self.parent), -1, dtype=np.int32)
+        self.ids[loops] = ids
+        self.order = loops[order]
+        self.start = np.searchsorted(ids[order], np.arange(len(labels) + 1))
+
+    def members(self, i):
+        """Loops of the uv vertex of loop i"""
+        if self.ids is None: self.group()
+        k = self.ids[i]
+        return self.order[self.start[k]:self.start[k + 1]]
+
+    def groups(self):
+        if self.ids is None: self.group()
+        for k in range(len(self.start) - 1):
+            yield self.order[self.start[k]:self.start[k + 1]]
+
+class UvGridIndex:
+    """Uniform grid hash over uv positions for radius bounded queries"""
+
+    def __init__(self, cellSize):
+        self.cellSize = cellSize
+        self.cells = defaultdict(list)
+
+    def cell(self, x, y):
+        return (floor(x / self.cellSize), floor(y / self.cellSize))
+
+    def insert(self, x, y, item):
+        self.cells[self.cell(x, y)].append((x, y, item))
+
+    def near(self, x, y, radius):
+        """Yields (x, y, item) of every entry in the cells touched by radius around x, y"""
+        reach = ceil(radius / self.cellSize)
+        cx, cy = self.cell(x, y)
+        for i in range(cx - reach, cx + reach + 1):
+            for j in range(cy - reach, cy + reach + 1):
+                cell = self.cells.get((i, j))
+                if cell != None: yield from cell
+
+    def closest(self, x, y, radius):
+        """Item closest to x, y that is less than radius away, None if there is none"""
+        min = radius
+        minItem = None
+        for ix, iy, item in self.near(x, y, radius):
+            hyp = hypot(x - ix, y - iy)
+            if hyp < min:
+                min = hyp
+                minItem = item
+        return minItem
+
+def IslandLabels(faceMask, loopFace, loopEdge):
+    """Island of every face, -1 for faces not in faceMask
+
+    Faces of faceMask are in the same island when they share an edge, given as
+    the face and edge of each loop (leave out loops that should not connect, like
+    seams). Union-find with all links hooked at once and paths compressed after,
+    the number of passes grows with the log of the island size.
+    """
+    keep = faceMask[loopFace]
+    loopFace = loopFace[keep]
+    loopEdge = loopEdge[keep]
+
+    #consecutive loops on the same edge link their faces
+    order = np.lexsort((loopFace, loopEdge))
+    edge = loopEdge[order]
+    face = loopFace[order]
+    same = edge[1:] == edge[:-1]
+    a = face[:-1][same]
+    b = face[1:][same]
+
+    parent = np.arange(len(faceMask))
+    while True:
+        pa = parent[a]
+        pb = parent[b]
+        apart = pa != pb
+        if not apart.any(): break
+        np.minimum.at(parent, np.maximum(pa, pb)[apart], np.minimum(pa, pb)[apart])
+        while True:
+            grand = parent[parent]
+            if (grand == parent).all(): break
+            parent = grand
+
+    labels = np.full(len(faceMask), -1, dtype=np.int32)
+    roots, labels[faceMask] = np.unique(parent[faceMask], return_inverse=True)
+    return labels
+
+def IslandMembers(labels):
+    """Faces of every island of IslandLabels, in increasing order"""
+    order = np.argsort(labels, kind='stable')
+    bounds = np.searchsorted(labels[order], np.arange(labels.max(initial=-1) + 2))
+    return [order[start:end] for start, end in zip(bounds[:-1], bounds[1:])]
+
+def RejoinPairs(uv, vert, edgeVerts, quadLoops, allowedError = 0.00001):
+    """(edge vert, quad loop) pairs of loops on the same mesh vert and uv spot
+
+    Taken before reshaping, the edge verts are then moved along with their quad loop.
+    vert holds the mesh vert of every loop.
+    """
+    vert = vert.tolist()
+    uvs = uv.tolist()
+    quadsAt = defaultdict(list)
+    for i in quadLoops:
+        quadsAt[vert[i]].append(i)
+
+    pairs = []
+    for ev in edgeVerts:
+        for i in quadsAt.get(vert[ev], ()):
+            if AreVertsQuasiEqual(uvs[ev], uvs[i], allowedError):
+                pairs.append((ev, i))
+                break
+    return pairs
+
+def RelaxUvVerts(uv, loops, ids, fixed, edges, iterations):
+    """Moves the free uv vertices of loops to the mean of their neighbours, iterations times
+
+    ids holds the uv vertex of every loop, fixed marks the uv vertices that keep
+    their place and edges are pairs of neighbouring uv vertices. All vertices move
+    at once from the positions of the previous iteration (Jacobi).
+    """
+    count = len(fixed)
+    pos = np.zeros((count, 2))
+    np.add.at(pos, ids, uv[loops])
+    pos /= np.bincount(ids, minlength=count)[:, None]
+
+    a, b = edges[:, 0], edges[:, 1]
+    degree = np.bincount(a, minlength=count) + np.bincount(b, minlength=count)
+    free = ~fixed & (degree > 0)
+    for i in range(iterations):
+        sums = np.zeros((count, 2))
+        np.add.at(sums, a, pos[b])
+        np.add.at(sums, b, pos[a])
+        pos[free] = sums[free] / degree[free, None]
+
+    moved = free[ids]
+    uv[loops[moved]] = pos[ids[moved]]
+
+def hypotVert(v1, v2):
+    hyp = hypot(v1[0] - v2[0], v1[1] - v2[1])
+    return hyp
+
+def AreVertsQuasiEqual(v1, v2, allowedError = 0.00001):
+    if abs(v1[0] -v2[0]) < allowedError and abs(v1[1] -v2[1]) < allowedError:
+        return True
+    return False